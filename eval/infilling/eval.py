@@ -4,8 +4,9 @@ import argparse
 import csv
 import dataclasses
 import time
-from typing import Dict, List, TextIO
+from typing import Dict, List, Optional, TextIO
 
+from preditor import nlp
 from preditor.infilling import blank, end, infilling, selection
 from preditor.model.model import Model
 from preditor.prediction import simple
@@ -60,7 +61,7 @@ def main() -> None:
         run(
             args.dataset, args.output,
             args.generate, args.select,
-            args.max_length, args.num_variants,
+            args.max_length, args.num_variants, args.max_scored_infills,
             args.progress,
         )
     eval(args.output)
@@ -69,11 +70,14 @@ def main() -> None:
 def run(
     dataset: str, out_filename: str,
     generate_funcname: str, select_funcname: str,
-    max_length: int, num_variants: int,
+    max_length: int, num_variants: int, max_scored_infills: Optional[int],
     show_progress: bool = False
 ) -> None:
     from preditor.server import model
-    config = infilling.InfillingConfig(max_length=max_length, num_variants=num_variants)
+    config = infilling.InfillingConfig(
+        max_length=max_length, num_variants=num_variants,
+        max_scored_infills=max_scored_infills,
+    )
     generate_func = GENERATE_FUNCS[generate_funcname]
     select_func = SELECT_FUNCS[select_funcname]
     with open(dataset) as in_file:
@@ -96,6 +100,8 @@ def run(
             end = time.time()
             result = Result(infill=infill, time=end - start, **dataclasses.asdict(example))
             writer.writerow(dataclasses.asdict(result))
+    print(f"Forward passes in scoring: {nlp.padding_stats.batches}")
+    print(f"Tokens processed in scoring: {nlp.padding_stats.real_tokens}")
 
 
 def eval(results_filename: str) -> None:
@@ -123,6 +129,7 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--select", choices=SELECT_FUNCS.keys(), required=True)
     parser.add_argument("--max-length", type=int, default=8)
     parser.add_argument("--num-variants", type=int, default=4)
+    parser.add_argument("--max-scored-infills", type=int, default=None)
     parser.add_argument("--progress", action="store_true")
     parser.add_argument("--results-only", action="store_true")
     return parser
@@ -14,5 +14,7 @@ python eval.py manual.csv manual-blank-match.csv --generate=blank --select=match
 python eval.py manual.csv manual-blank-score.csv --generate=blank --select=score
 python eval.py manual.csv manual-end-match.csv --generate=end --select=match
 python eval.py manual.csv manual-end-score.csv --generate=end --select=score
+python eval.py manual.csv manual-end-score-4.csv --generate=end --select=score --max-scored-infills=4
+python eval.py manual.csv manual-end-score-8.csv --generate=end --select=score --max-scored-infills=8
 python eval.py manual.csv manual-predict-match.csv --generate=predict --select=match
 python eval.py manual.csv manual-predict-score.csv --generate=predict --select=score
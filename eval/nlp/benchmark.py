@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+from typing import Callable, List
+
+import torch
+
+from preditor import nlp
+from preditor.config import Config
+
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+    # the logits are given, so no model is needed to apply the LM head
+    Config.scoring_mode = "full"
+    for batch_size in args.batch_sizes:
+        input_ids_batch = [
+            input_ids.to(args.device)
+            for input_ids in random_inputs(batch_size, args.length, args.vocab_size)
+        ]
+        logits = torch.randn(batch_size, args.length, args.vocab_size, device=args.device)
+        starts = [0] * batch_size
+        per_item_time = measure(
+            lambda: per_item_nlps(input_ids_batch, logits), args.repeats
+        )
+        batched_time = measure(
+            lambda: nlp._get_nlps_of_batch(None, input_ids_batch, logits, starts),
+            args.repeats
+        )
+        speedup = per_item_time / batched_time
+        print(
+            f"Batch size {batch_size}: per item {per_item_time * 1000:.2f}ms, "
+            f"batched {batched_time * 1000:.2f}ms, speedup {speedup:.1f}x"
+        )
+
+
+def per_item_nlps(input_ids_batch: List[torch.Tensor], logits: torch.Tensor) -> List[float]:
+    """Calculate the nlps one item at a time, as the scorer used to."""
+    nlps = []
+    for input_ids, item_logits in zip(input_ids_batch, logits):
+        text_ids = input_ids[1:]
+        softmax = torch.softmax(item_logits, dim=-1)
+        probs = softmax[torch.arange(len(text_ids)), text_ids]
+        nlps.append(-torch.log(probs).sum().item())
+    return nlps
+
+
+def random_inputs(batch_size: int, max_length: int, vocab_size: int) -> List[torch.Tensor]:
+    """Create random input ids of varying lengths, the longest is padded to none."""
+    lengths = torch.randint(max_length // 2, max_length + 1, (batch_size,)).tolist()
+    lengths[0] = max_length
+    return [torch.randint(vocab_size, (length + 1,)) for length in lengths]
+
+
+def measure(func: Callable[[], object], repeats: int) -> float:
+    """Return the best time of the function in seconds.
+
+    Both functions return Python floats, so the time includes the transfer.
+    """
+    func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 64])
+    parser.add_argument("--length", type=int, default=40)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--device", type=str, default="cpu")
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -33,7 +33,9 @@ def get_usefulness_data(
     text_stripped = input_text.rstrip()
     had_trailing_space = input_text != text_stripped
     config = PredictionConfig(max_length=max_length)
-    gen_ids, logits = confidence._get_model_outputs(model, text_stripped, had_trailing_space, config)
+    gen_ids, logits = confidence._get_model_outputs(
+        model, text_stripped, had_trailing_space, config, early_stopping=False
+    )
     tokens = [model.tokenizer.decode(x) for x in gen_ids]
     nlps = nlp.infer_nlps_from_logits(gen_ids, logits).tolist()
     # expected[i] is the expected usefulness of the prefix of length i
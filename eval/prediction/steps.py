@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+from typing import List, TextIO, Tuple
+
+from preditor.model.model import Model
+from preditor.prediction import confidence
+from preditor.prediction.config import PredictionConfig
+
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+    from preditor.server import model
+    config = PredictionConfig(max_length=args.max_length, confidence=args.confidence)
+    with open(args.dataset) as file:
+        texts = read_texts(file)
+    compare(model, texts, config, args.progress)
+
+
+def compare(
+    model: Model, texts: List[str], config: PredictionConfig,
+    show_progress: bool = False
+) -> None:
+    """Compare the decode steps with and without early stopping."""
+    full_steps = 0
+    early_steps = 0
+    different_outputs = 0
+    for i, text in enumerate(texts, start=1):
+        if show_progress:
+            print(f"{i}/{len(texts)}")
+        full_output, full_len = predict(model, text, config, early_stopping=False)
+        early_output, early_len = predict(model, text, config, early_stopping=True)
+        full_steps += full_len
+        early_steps += early_len
+        different_outputs += full_output != early_output
+
+    saved = full_steps - early_steps
+    percentage = saved / full_steps * 100
+    print(f"Decode steps without early stopping: {full_steps}")
+    print(f"Decode steps with early stopping: {early_steps}")
+    print(f"Steps saved: {saved} = {percentage:.1f}%")
+    print(f"Different outputs: {different_outputs}/{len(texts)}")
+
+
+def predict(
+    model: Model, input_text: str, config: PredictionConfig, early_stopping: bool
+) -> Tuple[str, int]:
+    """Predict the continuation. Return it and the number of decode steps."""
+    text_stripped = input_text.rstrip()
+    had_trailing_space = input_text != text_stripped
+    gen_ids, logits = confidence._get_model_outputs(
+        model, text_stripped, had_trailing_space, config,
+        early_stopping=early_stopping
+    )
+    output = confidence._select_output(model, gen_ids, logits, had_trailing_space, config)
+    return output, len(gen_ids)
+
+
+def read_texts(file: TextIO) -> List[str]:
+    """Read the texts before cursor from an infilling dataset."""
+    reader = csv.DictReader(file, delimiter="|")
+    return [row["before_cursor"] for row in reader if row["before_cursor"].strip()]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", type=str)
+    parser.add_argument("--max-length", type=int, default=10)
+    parser.add_argument("--confidence", type=float, default=7.0)
+    parser.add_argument("--progress", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+from typing import Counter, Iterator, List, Tuple
+
+from preditor import paradigms, tags
+
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+    with open(args.corpus) as file:
+        counts = count_paradigms(file)
+    print(f"Found {len(counts)} paradigms")
+    most_common = [key for key, _ in counts.most_common(args.max_paradigms)]
+    paradigms.write_index(args.output, generate(most_common))
+    print(f"Wrote {len(most_common)} paradigms to {args.output}")
+
+
+def count_paradigms(lines: Iterator[str]) -> Counter[Tuple[str, str]]:
+    """Count the lemmas and tag wildcards of the words in the corpus."""
+    counts: Counter[Tuple[str, str]] = collections.Counter()
+    for line in lines:
+        for form in tags.tag(line.strip()):
+            if form.lemma is not None and form.tag is not None:
+                counts[(form.lemma, tags.create_tag_wildcard(form.tag))] += 1
+    return counts
+
+
+def generate(
+    keys: List[Tuple[str, str]]
+) -> Iterator[Tuple[str, str, Tuple[str, ...]]]:
+    """Generate the forms for each lemma and wildcard."""
+    for lemma, wildcard in keys:
+        yield lemma, wildcard, tags.generate_forms(lemma, wildcard)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", type=str, help="text file, one sentence per line")
+    parser.add_argument("output", type=str)
+    parser.add_argument("--max-paradigms", type=int, default=50000)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
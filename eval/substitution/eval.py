@@ -5,10 +5,11 @@ import csv
 import dataclasses
 import enum
 import time
-from typing import Dict, Iterable, List, TextIO
+from typing import Dict, Iterable, List, Optional, TextIO
 
+from preditor import nlp
 from preditor.model.model import Model
-from preditor.substitution import dijkstra, substitution
+from preditor.substitution import beam, dijkstra, substitution
 
 
 @dataclasses.dataclass(frozen=True)
@@ -43,6 +44,8 @@ class ChangeType(enum.Enum):
 SUBSTITUTE_FUNCS: Dict[str, substitution.SubstituteFunc] = {
     "simple": dijkstra.replace,
     "cache": dijkstra.replace_with_cache,
+    "bound": dijkstra.replace_with_bound,
+    "beam": beam.replace,
 }
 
 
@@ -54,7 +57,7 @@ def main() -> None:
             args.dataset, args.output, args.strategy,
             args.min_variants, args.relax_count,
             args.pool_factor, args.lp_alpha,
-            args.progress
+            args.beam_width, args.quantize_cache, args.deadline_ms, args.progress
         )
     eval(args.output)
 
@@ -64,12 +67,14 @@ def run(
     substitute_funcname: str,
     min_variants: int, relax_count: int,
     pool_factor: int, lp_alpha: float,
+    beam_width: int = 4, quantize_cache: bool = False, deadline_ms: Optional[int] = None,
     show_progress: bool = False
 ) -> None:
     from preditor.server import model
     config = substitution.SubstitutionConfig(
         min_variants=min_variants, relax_count=relax_count,
-        pool_factor=pool_factor, lp_alpha=lp_alpha,
+        pool_factor=pool_factor, lp_alpha=lp_alpha, beam_width=beam_width,
+        quantize_cache=quantize_cache, deadline_ms=deadline_ms,
     )
     substitute_func = SUBSTITUTE_FUNCS[substitute_funcname]
     with open(dataset) as in_file:
@@ -88,7 +93,7 @@ def run(
             replaced = substitution.replace(
                 model, example.before_old, example.old, example.after_old,
                 example.replacement, config, substitute_func
-            )
+            ).text
             end = time.time()
             original = example.before_old + example.old + example.after_old
             result = Result(
@@ -96,6 +101,9 @@ def run(
                 original=original, expected=example.expected
             )
             writer.writerow(dataclasses.asdict(result))
+    print(f"Padding waste in scoring: {nlp.padding_stats.waste:.1%}")
+    print(f"Forward passes in scoring: {nlp.padding_stats.batches}")
+    print(f"Tokens processed in scoring: {nlp.padding_stats.real_tokens}")
 
 
 def eval(results_filename: str) -> None:
@@ -149,6 +157,9 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--relax-count", type=int, default=8)
     parser.add_argument("--pool-factor", type=int, default=5)
     parser.add_argument("--lp-alpha", type=float, default=0.0)
+    parser.add_argument("--beam-width", type=int, default=4)
+    parser.add_argument("--quantize-cache", action="store_true")
+    parser.add_argument("--deadline-ms", type=int, default=None)
     parser.add_argument("--progress", action="store_true")
     parser.add_argument("--results-only", action="store_true")
     return parser
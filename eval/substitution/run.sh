@@ -6,4 +6,10 @@ python eval.py manual.csv simple-10.csv --strategy=simple --lp-alpha=1.0
 python eval.py manual.csv cache-00.csv --strategy=cache --lp-alpha=0.0
 python eval.py manual.csv cache-05.csv --strategy=cache --lp-alpha=0.5
 python eval.py manual.csv cache-10.csv --strategy=cache --lp-alpha=1.0
+python eval.py manual.csv bound-00.csv --strategy=bound --lp-alpha=0.0
+python eval.py manual.csv bound-05.csv --strategy=bound --lp-alpha=0.5
+python eval.py manual.csv beam-2.csv --strategy=beam --beam-width=2
+python eval.py manual.csv beam-4.csv --strategy=beam --beam-width=4
+python eval.py manual.csv beam-8.csv --strategy=beam --beam-width=8
+python eval.py manual.csv cache-00-int8.csv --strategy=cache --lp-alpha=0.0 --quantize-cache
 
@@ -1,5 +1,6 @@
 """This module handles the model's attention cache."""
 
+import collections
 import dataclasses
 from typing import Iterable, List, Optional, Tuple
 
@@ -12,12 +13,18 @@ CacheLayer = Tuple[torch.Tensor, torch.Tensor]
 Cache = Tuple[CacheLayer, ...]
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(eq=False)
 class LazyCache:
-    """A cache that has not yet been trimmed."""
+    """A cache that has not yet been trimmed.
+
+    The tensors are either in the cache, or in the blocks of a pool.
+    They may be dropped to save memory, then both are None.
+    The length is kept, the positions need to be processed again.
+    """
 
-    cache: Cache
+    cache: Optional[Cache]
     length: int
+    blocks: Optional["PagedBlocks"] = None
 
 
 def cache_len(cache: Optional[LazyCache]) -> int:
@@ -27,23 +34,55 @@ def cache_len(cache: Optional[LazyCache]) -> int:
     return cache.length
 
 
+def available_len(cache: Optional[LazyCache]) -> int:
+    """Return the length of the cache, or zero if it was dropped."""
+    if cache is None or not _is_available(cache):
+        return 0
+    return cache.length
+
+
+def _is_available(cache: LazyCache) -> bool:
+    """Return whether the tensors of the cache were not dropped."""
+    return cache.cache is not None or cache.blocks is not None
+
+
 def join_caches_optional(caches: List[Optional[LazyCache]]) -> Optional[Cache]:
     """Join the caches along the batch dimension.
 
-    If any of the caches is None, the result is None.
+    If any of the caches is None or was dropped, the result is None.
     """
     # a bit convoluted to satisfy mypy
     # https://github.com/python/mypy/issues/4573
-    not_none = [cache for cache in caches if cache is not None]
-    if len(not_none) == len(caches):
-        return join_caches(not_none)
+    available = [
+        cache for cache in caches
+        if cache is not None and _is_available(cache)
+    ]
+    if len(available) == len(caches):
+        return join_caches(available)
     return None
 
 
-def join_caches(lazy_caches: Iterable[LazyCache]) -> Cache:
-    """Join the caches along the batch dimension."""
+def join_caches(lazy_caches: List[LazyCache]) -> Cache:
+    """Join the caches along the batch dimension.
+
+    None of the caches may be dropped.
+    If all of them are in the same pool, their blocks are gathered at once.
+    """
     length = min(cache.length for cache in lazy_caches)
-    caches = (cache.cache for cache in lazy_caches)
+    tables = [cache.blocks for cache in lazy_caches if cache.blocks is not None]
+    if len(tables) == len(lazy_caches) and len({id(t.pool) for t in tables}) == 1:
+        return tables[0].pool.gather([t.table for t in tables], length)
+    caches: List[Cache] = []
+    for lazy_cache in lazy_caches:
+        cache = lazy_cache.cache or _read_blocks(lazy_cache)
+        if cache is None:
+            raise ValueError("Cannot join a dropped cache.")
+        caches.append(cache)
+    return _join(caches, length)
+
+
+def _join(caches: List[Cache], length: int) -> Cache:
+    """Join the caches along the batch dimension, truncated to the length."""
     return tuple(
         _join_layers(layers, length)
         # one layer for each of the caches
@@ -83,3 +122,434 @@ def _split_layer(layer: CacheLayer) -> List[CacheLayer]:
         (keys[i : i + 1], values[i : i + 1])  # keeps the batch dimension
         for i in range(keys.size(0))
     ]
+
+
+def trim_cache(cache: Cache, start: int, end: int) -> Cache:
+    """Keep only the positions from start to end (exclusive)."""
+    return tuple(
+        (keys[:, :, start:end], values[:, :, start:end])
+        for keys, values in cache
+    )
+
+
+def shift_cache(cache: Cache, shift: int, length: int) -> Cache:
+    """Shift the cache right by the given number of positions.
+
+    The new positions are filled with zeros.
+    The result is truncated to the given length.
+    """
+    shift = min(shift, length)
+    return tuple(
+        (_shift_tensor(keys, shift, length), _shift_tensor(values, shift, length))
+        for keys, values in cache
+    )
+
+
+def _shift_tensor(tensor: torch.Tensor, shift: int, length: int) -> torch.Tensor:
+    """Shift the tensor right along the sequence dimension."""
+    batch_size, num_heads, _, head_dim = tensor.shape
+    zeros = tensor.new_zeros(batch_size, num_heads, shift, head_dim)
+    return torch.cat([zeros, tensor[:, :, :length - shift]], dim=2)
+
+
+def repeat_cache(cache: Cache, count: int) -> Cache:
+    """Repeat each item of the cache along the batch dimension."""
+    return tuple(
+        (keys.repeat_interleave(count, dim=0), values.repeat_interleave(count, dim=0))
+        for keys, values in cache
+    )
+
+
+def expand_cache(cache: Cache, count: int) -> Cache:
+    """Expand a cache of one item along the batch dimension.
+
+    The items share memory, the cache is not copied.
+    """
+    return tuple(
+        (keys.expand(count, -1, -1, -1), values.expand(count, -1, -1, -1))
+        for keys, values in cache
+    )
+
+
+def select_cache(cache: Cache, indices: torch.Tensor) -> Cache:
+    """Select the items of the cache with the given indices along the batch dimension.
+
+    An item may be selected more than once, e.g. when beams are reordered.
+    """
+    return tuple(
+        (keys.index_select(0, indices), values.index_select(0, indices))
+        for keys, values in cache
+    )
+
+
+def copy_cache(cache: Cache) -> Cache:
+    """Copy the cache so that it does not share memory with other tensors."""
+    return tuple(
+        (keys.clone(), values.clone())
+        for keys, values in cache
+    )
+
+
+class CacheManager:
+    """Keep the lazy caches of a search within a memory budget.
+
+    The model returns caches of a whole batch, the lazy caches are views of it.
+    The manager stores them in the blocks of a pool, so that the batch can be freed.
+    A cache shares the full blocks of the cache it was computed from.
+    When the pool is full, the least recently used caches are moved to the CPU,
+    if the budget for offloading allows it, or dropped.
+    The dropped caches need to be recomputed by the model.
+    """
+
+    def __init__(
+        self,
+        device: torch.device,
+        max_bytes: int,
+        max_offload_bytes: int = 0,
+        block_size: int = 16,
+        quantized: bool = False,
+    ) -> None:
+        self._pool = BlockPool(max_bytes, block_size, quantized)
+        # offloading from the CPU to the CPU would not save anything
+        self._max_offload_bytes = max_offload_bytes if device.type != "cpu" else 0
+        # the caches by their id, from the least recently used
+        self._resident: "collections.OrderedDict[int, LazyCache]" = (
+            collections.OrderedDict()
+        )
+        self._offloaded: "collections.OrderedDict[int, LazyCache]" = (
+            collections.OrderedDict()
+        )
+        self._offloaded_bytes = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._pool.used_bytes
+
+    def add(self, caches: Iterable[Tuple[LazyCache, Optional[LazyCache]]]) -> None:
+        """Take over the caches returned by the model.
+
+        Each cache is given with the cache it was computed from, if any.
+        """
+        for lazy_cache, parent in caches:
+            if lazy_cache.cache is not None:
+                self._store(lazy_cache, self._shared_blocks(lazy_cache, parent))
+
+    def use(self, caches: Iterable[Optional[LazyCache]]) -> None:
+        """Mark the caches as recently used, move them back from the CPU."""
+        for lazy_cache in caches:
+            if lazy_cache is None:
+                continue
+            key = id(lazy_cache)
+            if key in self._offloaded:
+                del self._offloaded[key]
+                self._offloaded_bytes -= _nbytes(lazy_cache)
+                self._store(lazy_cache, ())
+            elif key in self._resident:
+                self._resident.move_to_end(key)
+
+    def release(self, caches: Iterable[Optional[LazyCache]]) -> None:
+        """Stop managing the caches, they are no longer needed."""
+        for lazy_cache in caches:
+            if lazy_cache is None:
+                continue
+            key = id(lazy_cache)
+            if key in self._resident:
+                del self._resident[key]
+                self._drop(lazy_cache)
+            elif key in self._offloaded:
+                del self._offloaded[key]
+                self._offloaded_bytes -= _nbytes(lazy_cache)
+                self._drop(lazy_cache)
+
+    def _shared_blocks(
+        self, lazy_cache: LazyCache, parent: Optional[LazyCache]
+    ) -> Tuple[int, ...]:
+        """Return the full blocks of the parent that the cache begins with."""
+        if parent is None or parent.blocks is None:
+            return ()
+        count = min(parent.length, lazy_cache.length) // self._pool.block_size
+        return parent.blocks.table[:count]
+
+    def _store(self, lazy_cache: LazyCache, shared: Tuple[int, ...]) -> None:
+        """Move the tensors of the cache to the pool."""
+        cache = lazy_cache.cache
+        if cache is None:
+            return
+        self._pool.setup(cache)
+        # the shared blocks must not be freed by the eviction
+        self._pool.retain(shared)
+        needed = self._pool.num_blocks(lazy_cache.length) - len(shared)
+        self._evict(needed)
+        if self._pool.num_free < needed:
+            # the cache does not fit even on its own
+            self._pool.release(shared)
+            lazy_cache.cache = None
+            return
+        table = self._pool.write(cache, lazy_cache.length, shared)
+        lazy_cache.cache = None
+        lazy_cache.blocks = PagedBlocks(self._pool, table)
+        self._resident[id(lazy_cache)] = lazy_cache
+
+    def _evict(self, needed: int) -> None:
+        """Offload or drop the least recently used caches to free the blocks."""
+        while self._pool.num_free < needed and self._resident:
+            _, lazy_cache = self._resident.popitem(last=False)
+            offloaded = _read_blocks(lazy_cache)
+            self._drop(lazy_cache)
+            if offloaded is None or cache_nbytes(offloaded) > self._max_offload_bytes:
+                continue
+            lazy_cache.cache = _to_cpu(offloaded)
+            self._offloaded[id(lazy_cache)] = lazy_cache
+            self._offloaded_bytes += cache_nbytes(offloaded)
+            while self._offloaded_bytes > self._max_offload_bytes:
+                _, oldest = self._offloaded.popitem(last=False)
+                self._offloaded_bytes -= _nbytes(oldest)
+                self._drop(oldest)
+
+    def _drop(self, lazy_cache: LazyCache) -> None:
+        """Free the tensors of the cache."""
+        if lazy_cache.blocks is not None:
+            self._pool.release(lazy_cache.blocks.table)
+        lazy_cache.blocks = None
+        lazy_cache.cache = None
+
+
+class BlockPool:
+    """Store caches in blocks of a fixed number of positions.
+
+    The blocks of each layer are allocated in one tensor,
+    which grows up to the memory budget.
+    A cache is a table of the blocks that hold its positions.
+    Caches with a common beginning share its full blocks,
+    a block is freed once no cache refers to it.
+    If quantized, the blocks are stored in 8 bits.
+    """
+
+    def __init__(
+        self, max_bytes: int, block_size: int = 16, quantized: bool = False
+    ) -> None:
+        self.block_size = block_size
+        self._max_bytes = max_bytes
+        self._quantized = quantized
+        # known once the shape of the caches is
+        self._block_bytes = 0
+        self._max_blocks = 0
+        self._keys: List[_LayerBlocks] = []
+        self._values: List[_LayerBlocks] = []
+        self._refs: List[int] = []
+        self._free: List[int] = []
+
+    @property
+    def num_free(self) -> int:
+        """Return the number of blocks that can still be used."""
+        return len(self._free) + self._max_blocks - len(self._refs)
+
+    @property
+    def used_bytes(self) -> int:
+        return (len(self._refs) - len(self._free)) * self._block_bytes
+
+    def num_blocks(self, length: int) -> int:
+        """Return the number of blocks needed for the positions."""
+        return -(-length // self.block_size)
+
+    def setup(self, cache: Cache) -> None:
+        """Prepare the layers of the pool for caches shaped like this one."""
+        if self._keys:
+            return
+        for keys, values in cache:
+            self._keys.append(
+                _LayerBlocks.empty(keys, self.block_size, self._quantized)
+            )
+            self._values.append(
+                _LayerBlocks.empty(values, self.block_size, self._quantized)
+            )
+        self._block_bytes = sum(
+            blocks.block_nbytes for blocks in self._keys + self._values
+        )
+        self._max_blocks = int(self._max_bytes // self._block_bytes)
+
+    def retain(self, table: Tuple[int, ...]) -> None:
+        """Add a reference to each of the blocks."""
+        for block in table:
+            self._refs[block] += 1
+
+    def release(self, table: Tuple[int, ...]) -> None:
+        """Remove a reference from each of the blocks, free the unused ones."""
+        for block in table:
+            self._refs[block] -= 1
+            if self._refs[block] == 0:
+                self._free.append(block)
+
+    def write(
+        self, cache: Cache, length: int, shared: Tuple[int, ...]
+    ) -> Tuple[int, ...]:
+        """Store the positions of the cache up to the length.
+
+        The shared blocks already hold the beginning of the cache
+        and are retained. The rest is written to new blocks.
+        Return the table of the blocks.
+        """
+        start = len(shared) * self.block_size
+        new = self._allocate(self.num_blocks(length) - len(shared))
+        if new:
+            for layer, (keys, values) in enumerate(cache):
+                self._keys[layer].write(new, keys, start, length)
+                self._values[layer].write(new, values, start, length)
+        return shared + tuple(new)
+
+    def gather(self, tables: List[Tuple[int, ...]], length: int) -> Cache:
+        """Gather the caches from their blocks into one batch of the length."""
+        count = self.num_blocks(length)
+        rows = [table[:count] for table in tables]
+        return tuple(
+            (keys.read(rows, length), values.read(rows, length))
+            for keys, values in zip(self._keys, self._values)
+        )
+
+    def _allocate(self, count: int) -> List[int]:
+        """Take the free blocks, grow the pool if needed."""
+        missing = count - len(self._free)
+        if missing > 0:
+            self._grow(missing)
+        allocated = [self._free.pop() for _ in range(count)]
+        for block in allocated:
+            self._refs[block] = 1
+        return allocated
+
+    def _grow(self, missing: int) -> None:
+        """Add at least the missing number of blocks to each layer.
+
+        The pool doubles, so that it is copied only a few times.
+        """
+        size = len(self._refs)
+        new_size = min(self._max_blocks, max(2 * size, size + missing, 64))
+        added = new_size - size
+        for blocks in self._keys + self._values:
+            blocks.grow(added)
+        self._refs.extend([0] * added)
+        # the lowest blocks are taken first
+        self._free.extend(range(new_size - 1, size - 1, -1))
+
+
+@dataclasses.dataclass(frozen=True)
+class PagedBlocks:
+    """The blocks of a pool that hold a cache."""
+
+    pool: BlockPool
+    table: Tuple[int, ...]
+
+
+@dataclasses.dataclass
+class _LayerBlocks:
+    """The blocks of the keys or values of one layer.
+
+    If quantized, the data are 8-bit integers
+    with a scale for each position and head.
+    """
+
+    # shape [num_blocks, block_size, num_heads, head_dim]
+    data: torch.Tensor
+    # shape [num_blocks, block_size, num_heads, 1]
+    scales: Optional[torch.Tensor]
+    dtype: torch.dtype
+
+    @classmethod
+    def empty(
+        cls, tensor: torch.Tensor, block_size: int, quantized: bool
+    ) -> "_LayerBlocks":
+        """Create a layer with no blocks for tensors like this one."""
+        _, num_heads, _, head_dim = tensor.shape
+        if not quantized:
+            data = tensor.new_empty((0, block_size, num_heads, head_dim))
+            return cls(data, None, tensor.dtype)
+        data = tensor.new_empty((0, block_size, num_heads, head_dim), dtype=torch.int8)
+        scales = tensor.new_empty((0, block_size, num_heads, 1))
+        return cls(data, scales, tensor.dtype)
+
+    @property
+    def block_nbytes(self) -> int:
+        """Return the number of bytes of one block."""
+        tensors = [self.data] if self.scales is None else [self.data, self.scales]
+        return sum(
+            tensor.element_size() * tensor.shape[1:].numel() for tensor in tensors
+        )
+
+    def grow(self, added: int) -> None:
+        """Add empty blocks."""
+        self.data = _grow_blocks(self.data, added)
+        if self.scales is not None:
+            self.scales = _grow_blocks(self.scales, added)
+
+    def write(self, new: List[int], tensor: torch.Tensor, start: int, end: int) -> None:
+        """Write the positions of a tensor of one item to the new blocks.
+
+        The last block is padded with zeros.
+        """
+        block_size = self.data.shape[1]
+        positions = tensor[0, :, start:end].transpose(0, 1).to(self.data.device)
+        padding = -(end - start) % block_size
+        padded = torch.cat(
+            [positions, positions.new_zeros((padding, *positions.shape[1:]))]
+        )
+        blocks = padded.reshape(len(new), block_size, *positions.shape[1:])
+        index = torch.tensor(new, device=self.data.device)
+        if self.scales is None:
+            self.data[index] = blocks
+            return
+        quantized, scales = _quantize(blocks)
+        self.data[index] = quantized
+        self.scales[index] = scales
+
+    def read(self, rows: List[Tuple[int, ...]], length: int) -> torch.Tensor:
+        """Gather the rows of blocks into a tensor of the cache shape."""
+        index = torch.tensor(rows, dtype=torch.long, device=self.data.device)
+        gathered = self.data[index]
+        if self.scales is not None:
+            gathered = gathered.to(self.dtype) * self.scales[index]
+        batch_size, count, block_size, num_heads, head_dim = gathered.shape
+        positions = gathered.view(batch_size, count * block_size, num_heads, head_dim)
+        return positions[:, :length].transpose(1, 2)
+
+
+def _grow_blocks(blocks: torch.Tensor, added: int) -> torch.Tensor:
+    """Add empty blocks to the tensor."""
+    return torch.cat([blocks, blocks.new_empty((added, *blocks.shape[1:]))])
+
+
+def _quantize(tensor: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Quantize the tensor to 8 bits.
+
+    Each vector in the last dimension, i.e. one head at one position, has a scale.
+    """
+    absmax = tensor.abs().amax(dim=-1, keepdim=True)
+    scales = (absmax / 127).clamp(min=torch.finfo(tensor.dtype).tiny)
+    quantized = (tensor / scales).round().clamp(-127, 127).to(torch.int8)
+    return quantized, scales
+
+
+def _read_blocks(lazy_cache: LazyCache) -> Optional[Cache]:
+    """Read the cache from its blocks, if it has any."""
+    if lazy_cache.blocks is None:
+        return None
+    return lazy_cache.blocks.pool.gather([lazy_cache.blocks.table], lazy_cache.length)
+
+
+def _to_cpu(cache: Cache) -> Cache:
+    """Move the cache to the CPU."""
+    return tuple((keys.cpu(), values.cpu()) for keys, values in cache)
+
+
+def _nbytes(lazy_cache: LazyCache) -> int:
+    """Return the number of bytes of the tensors kept in the lazy cache."""
+    if lazy_cache.cache is None:
+        return 0
+    return cache_nbytes(lazy_cache.cache)
+
+
+def cache_nbytes(cache: Cache) -> int:
+    """Return the number of bytes used by the tensors in the cache."""
+    return sum(
+        tensor.element_size() * tensor.nelement()
+        for layer in cache
+        for tensor in layer
+    )
@@ -0,0 +1,93 @@
+"""This module allows stopping requests that are no longer needed.
+
+While the user types, each new request in a session
+makes the previous one obsolete.
+"""
+
+import contextlib
+import threading
+from typing import Dict, Hashable, Iterator, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+
+class Cancelled(Exception):
+    """The computation was cancelled before it finished."""
+
+
+class CancelToken:
+    """A flag telling a running computation to stop."""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        """Ask the computation to stop."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self) -> None:
+        """Raise Cancelled if the computation should stop."""
+        if self.cancelled:
+            raise Cancelled()
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """Stop the generation of the rows whose token was cancelled.
+
+    There is one token for each item in the batch.
+    All beams of an item share its token.
+    """
+
+    def __init__(self, tokens: List[Optional[CancelToken]]) -> None:
+        self.tokens = tokens
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        cancelled = torch.tensor(
+            [token is not None and token.cancelled for token in self.tokens],
+            device=input_ids.device
+        )
+        num_beams = input_ids.shape[0] // len(self.tokens)
+        return cancelled.repeat_interleave(num_beams)
+
+
+def get_stopping_criteria(tokens: List[Optional[CancelToken]]) -> StoppingCriteriaList:
+    """Get the criteria for stopping the generation once cancelled."""
+    criteria = StoppingCriteriaList()
+    if any(token is not None for token in tokens):
+        criteria.append(CancelStoppingCriteria(tokens))
+    return criteria
+
+
+class InFlightRequests:
+    """Keep track of the running request in each session.
+
+    A new request in a session supersedes the running one.
+    """
+
+    def __init__(self) -> None:
+        self._tokens: Dict[Hashable, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self, key: Hashable) -> Iterator[CancelToken]:
+        """Register a new request and cancel the previous one.
+
+        Yield the token of the new request.
+        """
+        token = CancelToken()
+        with self._lock:
+            previous = self._tokens.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._tokens[key] = token
+        try:
+            yield token
+        finally:
+            with self._lock:
+                if self._tokens.get(key) is token:
+                    del self._tokens[key]
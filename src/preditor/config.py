@@ -11,6 +11,29 @@ class Config:
     model_path: str = ""
     fasttext_path: str = ""
     tagger_path: str = ""
+    # concurrent predictions are decoded together in batches of this size
+    prediction_batch_size: int = 8
+    # how long the first request in a batch waits for others to join
+    prediction_batch_wait_ms: float = 10.0
+    # memory budget for the attention caches of previous prompts in sessions
+    session_cache_mb: int = 512
+    # maximum number of padded tokens scored by the model in one batch
+    scoring_token_budget: int = 4096
+    # "lean" applies the LM head in small chunks when scoring,
+    # "full" lets the model compute the logits of the whole batch at once
+    scoring_mode: str = "lean"
+    # memory budget for the attention caches of one substitution search
+    substitution_cache_mb: int = 1024
+    # budget for the caches moved from the GPU to the CPU when over the above
+    substitution_offload_mb: int = 0
+    # concurrent substitution searches score their nodes together, 0 disables it
+    substitution_interleave: int = 1
+    # number of generated paradigms kept in memory
+    paradigm_cache_size: int = 65536
+    # index of prebuilt paradigms, see eval/substitution/build_paradigm_index.py
+    paradigm_index_path: str = ""
+    # directory for the masks of the tokens to suppress, empty disables storing them
+    vocabulary_cache_dir: str = ""
 
 
 dotenv.load_dotenv()
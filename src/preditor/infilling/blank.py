@@ -3,14 +3,16 @@
 It generates infills by instructing the model to fill in the blank marker.
 """
 
-import functools
-from typing import List
+from typing import List, Optional
 
+import torch
 from transformers import PreTrainedTokenizer
 
+from preditor.cancellation import CancelToken
 from preditor.infilling.config import InfillingConfig
 from preditor.model.model import Model
-from preditor.suggestion import generation
+from preditor.sessions import PrefixCache
+from preditor.suggestion import generation, vocabulary
 
 # this code is very similar to the end strategy
 # it is intentionally not refactored
@@ -26,7 +28,9 @@ PROMPT = "{0}\n{1} ___ {2}\n{1}"
 
 def generate_infills(
     model: Model, before_cursor: str, after_cursor: str,
-    config: InfillingConfig, lang: str = "en"
+    config: InfillingConfig, lang: str = "en",
+    prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
 ) -> List[str]:
     """Generate possible infills between the given strings.
 
@@ -36,10 +40,10 @@ def generate_infills(
     after_stripped = after_cursor.lstrip()
     had_trailing_space = before_cursor != before_stripped
     input_text = _format_input(before_stripped, after_stripped, lang)
-    blank_tokens = _get_blank_tokens(model.tokenizer)
+    blank_mask = get_blank_mask(model.tokenizer)
     decoded = generation.beam_search(
-        model, input_text, had_trailing_space, blank_tokens,
-        config.max_length, config.num_variants
+        model, input_text, had_trailing_space, blank_mask,
+        config.max_length, config.num_variants, prefix_cache, cancel_token
     )
     return [generation.trim_decoded(d, had_trailing_space) for d in decoded]
 
@@ -52,16 +56,14 @@ def _format_input(before: str, after: str, lang: str) -> str:
     return PROMPT.format(instruction, before, after)
 
 
-@functools.lru_cache(maxsize=None)
-def _get_blank_tokens(tokenizer: PreTrainedTokenizer) -> List[int]:
-    """Return a list of tokens that resemble the blank marker.
+def get_blank_mask(tokenizer: PreTrainedTokenizer) -> torch.Tensor:
+    """Return the mask of the tokens that resemble the blank marker.
 
     Such tokens should be suppressed from the output.
     """
-    token_ids = tokenizer.get_vocab().values()
-    result: List[int] = []
-    for token_id in token_ids:
-        token = tokenizer.decode(token_id)
-        if "_" in token or ".." in token:
-            result.append(token_id)
-    return result
+    return vocabulary.get_mask(tokenizer, "blank", _resembles_blank)
+
+
+def _resembles_blank(text: str) -> bool:
+    """Return whether the text of a token resembles the blank marker."""
+    return "_" in text or ".." in text
@@ -1,5 +1,7 @@
 """This module provides configuration for the infilling algorithms."""
 
+from typing import Optional
+
 import pydantic
 
 
@@ -8,7 +10,11 @@ class InfillingConfig(pydantic.BaseModel):
 
     max_length: The maximum number of tokens generated during infilling.
     num_variants: The number of variants that infilling chooses from.
+    max_scored_infills: The number of candidate infills scored with
+        the whole text after cursor, the rest is pruned by a cheaper score.
+        If None, all candidates are scored.
     """
 
     max_length: int = pydantic.Field(8, ge=1)
     num_variants: int = pydantic.Field(4, ge=2)
+    max_scored_infills: Optional[int] = pydantic.Field(None, ge=1)
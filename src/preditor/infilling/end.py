@@ -4,10 +4,13 @@ It generates infills by instructing the model to continue the text
 such that it ends with a given string.
 """
 
-from typing import List
+import re
+from typing import List, Optional, Pattern
 
+from preditor.cancellation import CancelToken
 from preditor.infilling.config import InfillingConfig
 from preditor.model.model import Model
+from preditor.sessions import PrefixCache
 from preditor.suggestion import generation
 
 # this code is very similar to the blank strategy
@@ -22,20 +25,24 @@ PROMPT = "{0}: {2}\n{1}"
 
 def generate_infills(
     model: Model, before_cursor: str, after_cursor: str,
-    config: InfillingConfig, lang: str = "en"
+    config: InfillingConfig, lang: str = "en",
+    prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
 ) -> List[str]:
     """Generate possible infills between the given strings.
 
     Instruct the model to continue the text before the cursor
     such that it ends with the text after the cursor.
+    A variant ends once it reaches the text after the cursor.
     """
     before_stripped = before_cursor.rstrip()
     after_stripped = after_cursor.lstrip()
     had_trailing_space = before_cursor != before_stripped
     input_text = _format_input(before_stripped, after_stripped, lang)
     decoded = generation.beam_search(
-        model, input_text, had_trailing_space, [],
-        config.max_length, config.num_variants
+        model, input_text, had_trailing_space, None,
+        config.max_length, config.num_variants, prefix_cache, cancel_token,
+        _get_stop_pattern(after_stripped),
     )
     return [generation.trim_decoded(d, had_trailing_space) for d in decoded]
 
@@ -46,3 +53,22 @@ def _format_input(before: str, after: str, lang: str) -> str:
         lang = "en"
     instruction = INSTRUCTIONS[lang]
     return PROMPT.format(instruction, before, after)
+
+
+def _get_stop_pattern(after: str) -> Pattern[str]:
+    """Create the pattern that ends the generation of an infill.
+
+    It matches a newline or the first word of the text after cursor,
+    once the infill has some text before them.
+    The selection only needs the start of the text after cursor to find the infill,
+    and the text after a newline is dropped, see generation.trim_decoded.
+    """
+    ends = [r"\n"]
+    first_word = re.match(r"\w+|\S", after)
+    if first_word is not None:
+        word = re.escape(first_word.group())
+        if re.match(r"\w", first_word.group()):
+            # the word must not be a part of another word
+            word = r"(?<!\w)" + word + r"(?!\w)"
+        ends.append(word)
+    return re.compile(r"\S.*?(?:" + "|".join(ends) + ")", re.DOTALL)
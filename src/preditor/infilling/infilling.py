@@ -8,7 +8,7 @@ from preditor.infilling.config import InfillingConfig
 from preditor.model.model import Model
 
 GenerateFunc = Callable[[Model, str, str, InfillingConfig, str], List[str]]
-SelectFunc = Callable[[List[str], Model, str, str], str]
+SelectFunc = Callable[[List[str], Model, str, str, InfillingConfig], str]
 LANGS = ["en", "cs"]
 
 def infill(
@@ -27,7 +27,7 @@ def infill(
     if not variants:
         return ""
     selected = select_func(
-        variants, model, before_cursor, after_cursor
+        variants, model, before_cursor, after_cursor, config
     )
     return selected
 
@@ -4,16 +4,19 @@ These strategies select the best infill from a list of variants.
 """
 
 import re
-from typing import Iterable, List, Set
+from typing import Iterable, List, Optional, Set
 
 from preditor import nlp
+from preditor.infilling.config import InfillingConfig
 from preditor.model.model import Model
+from preditor.sessions import PrefixCache
 from preditor.suggestion import generation
 
 
 def select_by_match(
     variants: List[str],
     model: Model, before_cursor: str, after_cursor: str,
+    config: InfillingConfig,
 ) -> str:
     """Return the variant that best matches the text after cursor.
 
@@ -56,24 +59,78 @@ def get_number_of_tokens(model: Model, text: str) -> int:
 def select_by_score(
     variants: List[str],
     model: Model, before_cursor: str, after_cursor: str,
+    config: InfillingConfig,
+    prefix_cache: Optional[PrefixCache] = None,
 ) -> str:
     """Select the best infill from given variants.
 
     Score the sentence filled with all possible prefixes of the variants.
     Return the prefix that yields the best score.
+    If there are more prefixes than config.max_scored_infills,
+    only the best of them by a cheaper score are scored,
+    unless the text after cursor is too short for that to save work.
+    If a prefix cache is given, reuse the cache of the text before cursor
+    from the previous request.
     """
     variants = list(_expand_prefixes(variants))
     if not variants:
         return ""
+    max_scored = config.max_scored_infills
+    if (
+        max_scored is not None
+        and len(variants) > max_scored
+        and _is_pruning_cheaper(variants, after_cursor, max_scored)
+    ):
+        variants = _prune_infills(
+            variants, model, before_cursor, after_cursor, max_scored, prefix_cache
+        )
     final = [
         before_cursor + variant + after_cursor
         for variant in variants
     ]
-    nlps = nlp.infer_nlp(model, final)
+    # all of the texts start with the text before cursor,
+    # only the parts after it decide which one is best
+    nlps = nlp.infer_nlp_after_shared_prefix(model, final, prefix_cache)
     argmin = min(range(len(nlps)), key=nlps.__getitem__)
     return variants[argmin]
 
 
+def _prune_infills(
+    infills: List[str],
+    model: Model, before_cursor: str, after_cursor: str,
+    count: int, prefix_cache: Optional[PrefixCache],
+) -> List[str]:
+    """Keep the given number of infills that best fit the word after cursor.
+
+    The candidates are mostly prefixes of the same few variants,
+    they differ in where they end.
+    The first word after cursor tells that apart
+    for a fraction of the tokens of the whole text after cursor.
+    """
+    after_start = _first_word(after_cursor) or after_cursor
+    texts = [before_cursor + infill + after_start for infill in infills]
+    nlps = nlp.infer_nlp_after_shared_prefix(model, texts, prefix_cache)
+    best = sorted(range(len(infills)), key=nlps.__getitem__)[:count]
+    return [infills[i] for i in best]
+
+
+def _is_pruning_cheaper(infills: List[str], after_cursor: str, count: int) -> bool:
+    """Return whether pruning processes less text than scoring all infills.
+
+    Pruning scores every infill with the first word after cursor,
+    and then the kept ones again with the whole text after cursor.
+    The text before cursor is cached, so it is left out.
+    """
+    after_start = _first_word(after_cursor) or after_cursor
+    infill_len = sum(len(infill) for infill in infills) / len(infills)
+    all_scored = len(infills) * (infill_len + len(after_cursor))
+    pruned = (
+        len(infills) * (infill_len + len(after_start))
+        + count * (infill_len + len(after_cursor))
+    )
+    return pruned < all_scored
+
+
 def _expand_prefixes(infill_texts: Iterable[str]) -> Set[str]:
     """Generate all prefixes of the generated texts.
 
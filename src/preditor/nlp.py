@@ -1,11 +1,52 @@
-"""This module provides functions that calculate the sentence score."""
+"""This module provides functions that calculate the sentence score.
 
-from typing import List, Optional, Tuple
+The texts are scored in micro-batches of similar lengths,
+so that little computation is wasted on padding.
+The size of the batches is limited by a budget of padded tokens.
+
+In the lean scoring mode, the full-vocabulary logits of a batch are never
+materialized. The LM head is applied to the hidden states in small chunks.
+"""
+
+import dataclasses
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
 import torch
 
 from preditor import caching
+from preditor.config import Config
 from preditor.model.model import Model
+from preditor.sessions import PrefixCache
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclasses.dataclass
+class PaddingStats:
+    """Counts of the scoring batches and of the tokens processed in them.
+
+    Each batch is one forward pass of the model.
+    """
+
+    real_tokens: int = 0
+    padded_tokens: int = 0
+    batches: int = 0
+
+    @property
+    def waste(self) -> float:
+        """Return the fraction of the processed tokens that are padding."""
+        if self.padded_tokens == 0:
+            return 0.0
+        return 1 - self.real_tokens / self.padded_tokens
+
+
+# the totals since the start, they help to tune the token budget
+padding_stats = PaddingStats()
+_stats_lock = threading.Lock()
+# number of positions whose log-softmax is computed at once
+_LOGITS_CHUNK_SIZE = 64
 
 
 def infer_nlp_single(model: Model, text: str) -> float:
@@ -19,14 +60,11 @@ def infer_nlp(model: Model, texts: List[str]) -> List[float]:
     The texts are processed in a batch, which is faster than processing
     them one by one.
     """
-    input_ids_batch = [_encode_with_eos(model, text)[0] for text in texts]
-    trimmed_batch = _trim_and_pad(input_ids_batch)
-    with torch.no_grad():
-        logits_batch = model.model(trimmed_batch).logits
-    return [
-        _get_nlp_of_input(input_ids, logits)
-        for input_ids, logits in zip(input_ids_batch, logits_batch)
-    ]
+    input_ids_batch = [encode_with_eos(model, text)[0] for text in texts]
+    spans = [(0, len(input_ids) - 1) for input_ids in input_ids_batch]
+    return _map_in_batches(
+        lambda batch: _infer_nlp_of_ids(model, batch), input_ids_batch, spans
+    )
 
 
 def infer_nlp_with_cache(
@@ -39,22 +77,77 @@ def infer_nlp_with_cache(
     The texts are processed in a batch, which is faster than processing
     them one by one.
     """
-    input_ids_batch = [_encode_with_eos(model, text)[0] for text in texts]
-    trimmed_batch = _trim_and_pad(input_ids_batch)
-    logits_batch, caches = _get_outputs_with_cache(model, trimmed_batch, in_caches)
-    logits_shift = trimmed_batch.shape[1] - logits_batch.shape[1]
-    starts = [caching.cache_len(cache) for cache in in_caches]
-    nlps = [
-        _get_nlp_of_input(input_ids[start:], logits[start - logits_shift:])
-        for input_ids, logits, start in zip(input_ids_batch, logits_batch, starts)
-    ]
-    out_caches = [
-        caching.LazyCache(cache, len(input_ids) - 1)
-        for input_ids, cache in zip(input_ids_batch, caches)
+    input_ids_batch = [encode_with_eos(model, text)[0] for text in texts]
+    return infer_nlp_of_ids_with_cache(model, input_ids_batch, in_caches)
+
+
+def infer_nlp_of_ids_with_cache(
+    model: Model,
+    input_ids_batch: List[torch.Tensor],
+    in_caches: List[Optional[caching.LazyCache]],
+) -> Tuple[List[float], List[caching.LazyCache]]:
+    """Infer the negative log probability of the encoded texts. Use the cache.
+
+    The input ids begin with EOS, see encode_with_eos.
+    """
+
+    def score_batch(
+        batch: List[Tuple[torch.Tensor, Optional[caching.LazyCache]]]
+    ) -> List[Tuple[float, caching.LazyCache]]:
+        input_ids_batch, in_caches = map(list, zip(*batch))
+        nlps, out_caches = _infer_batch_with_cache(model, input_ids_batch, in_caches)
+        return list(zip(nlps, out_caches))
+
+    # only the tokens after the cache are processed
+    spans = [
+        (caching.available_len(cache), len(input_ids) - 1)
+        for input_ids, cache in zip(input_ids_batch, in_caches)
     ]
+    results = _map_in_batches(score_batch, list(zip(input_ids_batch, in_caches)), spans)
+    nlps = [nlp for nlp, _ in results]
+    out_caches = [cache for _, cache in results]
     return nlps, out_caches
 
 
+def infer_nlp_shared_prefix(model: Model, texts: List[str]) -> List[float]:
+    """Infer the negative log probability of the texts.
+
+    The tokens at the beginning shared by all texts are processed only once.
+    Their cache is then shared by the rest of the texts.
+    This is faster if the texts have a long common beginning,
+    e.g. when they only differ in a filled-in part.
+    """
+    input_ids_batch = [encode_with_eos(model, text)[0] for text in texts]
+    prefix_len = _shared_prefix_len(input_ids_batch)
+    # the cache of the prefix ends before its last token
+    if len(texts) < 2 or prefix_len < 2:
+        return infer_nlp(model, texts)
+    prefix_ids = input_ids_batch[0][:prefix_len]
+    [prefix_nlp], [prefix_cache] = _score_with_cache(model, [prefix_ids], [0], None)
+    suffix_nlps = _score_suffixes(model, input_ids_batch, prefix_len, prefix_cache)
+    return [prefix_nlp + suffix_nlp for suffix_nlp in suffix_nlps]
+
+
+def infer_nlp_after_shared_prefix(
+    model: Model, texts: List[str], prefix_cache: Optional[PrefixCache] = None
+) -> List[float]:
+    """Infer the negative log probability of the texts after their shared prefix.
+
+    The shared prefix is the same context for all texts,
+    so its nlp is left out, it would not change their order.
+    If a prefix cache is given, the cache of the prefix is looked up there
+    and stored back, so that only the tokens new since the previous call
+    are processed.
+    """
+    input_ids_batch = [encode_with_eos(model, text)[0] for text in texts]
+    prefix_len = _shared_prefix_len(input_ids_batch)
+    if len(texts) < 2 or prefix_len < 2:
+        return infer_nlp(model, texts)
+    prefix_ids = input_ids_batch[0][:prefix_len]
+    cache = _prefill(model, prefix_ids, prefix_cache)
+    return _score_suffixes(model, input_ids_batch, prefix_len, cache)
+
+
 def infer_nlps_from_logits(
     text_ids: torch.Tensor, logits: torch.Tensor
 ) -> torch.Tensor:
@@ -62,16 +155,173 @@ def infer_nlps_from_logits(
 
     The i-th logits predict the i-th token.
     """
-    softmax = torch.softmax(logits, dim=-1)
-    probs = softmax[torch.arange(len(text_ids)), text_ids]
-    return -torch.log(probs)
+    log_probs = torch.log_softmax(logits, dim=-1)
+    return -log_probs[torch.arange(len(text_ids)), text_ids]
 
 
-def _encode_with_eos(model: Model, text: str) -> torch.Tensor:
+def encode_with_eos(model: Model, text: str) -> torch.Tensor:
     """Encode text with EOS token."""
     input_ids = model.tokenizer.encode(text, return_tensors="pt")
     eos_tensor = torch.tensor(model.tokenizer.eos_token_id).reshape(1, 1)
-    return torch.cat([eos_tensor, input_ids], dim=-1).to(model.device)
+    # an empty text is encoded as an empty float tensor
+    return torch.cat([eos_tensor, input_ids.long()], dim=-1).to(model.device)
+
+
+def _infer_nlp_of_ids(model: Model, input_ids_batch: List[torch.Tensor]) -> List[float]:
+    """Infer the negative log probability of the encoded texts in one batch."""
+    trimmed_batch = _trim_and_pad(input_ids_batch)
+    outputs, _ = _forward(model, {"input_ids": trimmed_batch, "use_cache": False})
+    starts = [0] * len(input_ids_batch)
+    return _get_nlps_of_batch(model, input_ids_batch, outputs, starts)
+
+
+def _infer_batch_with_cache(
+    model: Model,
+    input_ids_batch: List[torch.Tensor],
+    in_caches: List[Optional[caching.LazyCache]],
+) -> Tuple[List[float], List[caching.LazyCache]]:
+    """Infer the negative log probability of the encoded texts in one batch."""
+    cache_batch = caching.join_caches_optional(in_caches)
+    starts = [caching.cache_len(cache) for cache in in_caches]
+    nlps, caches = _score_with_cache(model, input_ids_batch, starts, cache_batch)
+    out_caches = [
+        caching.LazyCache(cache, len(input_ids) - 1)
+        for input_ids, cache in zip(input_ids_batch, caches)
+    ]
+    return nlps, out_caches
+
+
+def _score_with_cache(
+    model: Model,
+    input_ids_batch: List[torch.Tensor],
+    starts: List[int],
+    cache_batch: Optional[caching.Cache],
+) -> Tuple[List[float], List[caching.Cache]]:
+    """Score the encoded texts from the given starts.
+
+    The tokens before the start are not included in the nlp.
+    The cache may be shorter than the starts, but not longer.
+    """
+    trimmed_batch = _trim_and_pad(input_ids_batch)
+    outputs, caches = _get_outputs_with_cache(model, trimmed_batch, cache_batch)
+    nlps = _get_nlps_of_batch(model, input_ids_batch, outputs, starts)
+    return nlps, caches
+
+
+def _map_in_batches(
+    func: Callable[[List[T]], List[R]], items: List[T], spans: List[Tuple[int, int]]
+) -> List[R]:
+    """Apply the function to micro-batches of the items.
+
+    The span of an item is the range of positions the model processes for it,
+    from the end of its cache to its last input.
+    Return the results in the original order.
+    """
+    results: List[Optional[R]] = [None] * len(items)
+    for indices in _split_into_batches(spans, Config.scoring_token_budget):
+        batch_results = func([items[i] for i in indices])
+        for i, result in zip(indices, batch_results):
+            results[i] = result
+        _record_padding([spans[i] for i in indices])
+    return results  # type: ignore[return-value]
+
+
+def _split_into_batches(
+    spans: List[Tuple[int, int]], token_budget: int
+) -> List[List[int]]:
+    """Split the indices of the items into batches of similar spans.
+
+    The caches of a batch are cut to the shortest one,
+    so every item is processed from the earliest start to the latest end.
+    The padded batch fits in the token budget,
+    and at most half of it is padding or recomputed cache.
+    So an item without a cache is not joined with items that have a long one.
+    A longer item than the budget gets a batch of its own.
+    """
+    order = sorted(range(len(spans)), key=lambda i: spans[i], reverse=True)
+    batches: List[List[int]] = []
+    for i in order:
+        if batches and _fits([spans[j] for j in batches[-1] + [i]], token_budget):
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    return batches
+
+
+def _fits(spans: List[Tuple[int, int]], token_budget: int) -> bool:
+    """Return whether a batch of the spans fits in the budget with little padding."""
+    padded_tokens = _padded_len(spans)
+    real_tokens = sum(end - start for start, end in spans)
+    return padded_tokens <= token_budget and padded_tokens <= 2 * real_tokens
+
+
+def _padded_len(spans: List[Tuple[int, int]]) -> int:
+    """Return the number of tokens the model processes for a batch of the spans."""
+    width = max(end for _, end in spans) - min(start for start, _ in spans)
+    return width * len(spans)
+
+
+def _record_padding(spans: List[Tuple[int, int]]) -> None:
+    """Add the tokens of one batch to the padding stats."""
+    with _stats_lock:
+        padding_stats.real_tokens += sum(end - start for start, end in spans)
+        padding_stats.padded_tokens += _padded_len(spans)
+        padding_stats.batches += 1
+
+
+def _shared_prefix_len(input_ids_batch: List[torch.Tensor]) -> int:
+    """Return the length of the prefix whose cache the inputs can share.
+
+    Each input needs at least one token to process after the prefix.
+    """
+    max_prefix_len = min(len(input_ids) for input_ids in input_ids_batch) - 1
+    return min(_common_prefix_len(input_ids_batch), max_prefix_len)
+
+
+def _prefill(
+    model: Model, prefix_ids: torch.Tensor, prefix_cache: Optional[PrefixCache]
+) -> caching.Cache:
+    """Return the cache of the prefix before its last token.
+
+    Only the tokens missing in the prefix cache are processed.
+    """
+    cache = None
+    if prefix_cache is not None:
+        cache, length = prefix_cache.lookup(prefix_ids)
+        if length == len(prefix_ids) - 1:
+            return cache
+    _, [cache] = _score_with_cache(model, [prefix_ids], [0], cache)
+    if prefix_cache is not None:
+        prefix_cache.update(prefix_ids[:-1], cache)
+    return cache
+
+
+def _score_suffixes(
+    model: Model,
+    input_ids_batch: List[torch.Tensor],
+    prefix_len: int,
+    prefix_cache: caching.Cache,
+) -> List[float]:
+    """Score the encoded texts after the prefix whose cache is given."""
+
+    def score_batch(batch: List[torch.Tensor]) -> List[float]:
+        cache_batch = caching.expand_cache(prefix_cache, len(batch))
+        starts = [prefix_len - 1] * len(batch)
+        nlps, _ = _score_with_cache(model, batch, starts, cache_batch)
+        return nlps
+
+    spans = [(prefix_len - 1, len(input_ids) - 1) for input_ids in input_ids_batch]
+    return _map_in_batches(score_batch, input_ids_batch, spans)
+
+
+def _common_prefix_len(input_ids_batch: List[torch.Tensor]) -> int:
+    """Return the number of tokens at the beginning shared by all inputs."""
+    min_len = min(len(input_ids) for input_ids in input_ids_batch)
+    beginnings = torch.stack([input_ids[:min_len] for input_ids in input_ids_batch])
+    mismatches = (beginnings != beginnings[0]).any(dim=0).nonzero()
+    if len(mismatches) > 0:
+        return int(mismatches[0].item())
+    return min_len
 
 
 def _trim_and_pad(input_ids: List[torch.Tensor]) -> torch.Tensor:
@@ -84,25 +334,104 @@ def _trim_and_pad(input_ids: List[torch.Tensor]) -> torch.Tensor:
     return torch.nn.utils.rnn.pad_sequence(trimmed, batch_first=True)
 
 
-def _get_nlp_of_input(input_ids: torch.Tensor, logits: torch.Tensor) -> float:
-    """Calculate the nlp for one item in batch.
+def _get_nlps_of_batch(
+    model: Model,
+    input_ids_batch: List[torch.Tensor],
+    outputs: torch.Tensor,
+    starts: List[int],
+) -> List[float]:
+    """Calculate the nlp for each item in batch.
+
+    The outputs of the last positions in the padded batch are given,
+    the positions before them were processed with a cache.
+    Only the tokens after the start of the item are included.
+    All the nlps are transferred from the device at once.
+    """
+    num_positions = outputs.shape[1]
+    padded_ids = torch.nn.utils.rnn.pad_sequence(input_ids_batch, batch_first=True)
+    # the logits at a position predict the next token
+    first = padded_ids.shape[1] - 1 - num_positions
+    target_ids = padded_ids[:, first + 1:]
+    mask = _get_target_mask(input_ids_batch, starts, first, num_positions)
+    nlps = _gather_nlps(model, outputs, target_ids)
+    return nlps.masked_fill(~mask, 0).sum(dim=1).tolist()
+
+
+def _get_target_mask(
+    input_ids_batch: List[torch.Tensor], starts: List[int], first: int, num_positions: int
+) -> torch.Tensor:
+    """Mask the positions whose logits predict a token after the start of the item.
+
+    The mask is on the device of the input ids.
+    """
+    device = input_ids_batch[0].device
+    positions = torch.arange(first, first + num_positions, device=device)
+    starts_tensor = torch.tensor(starts, device=device).unsqueeze(1)
+    lengths = torch.tensor([len(input_ids) for input_ids in input_ids_batch], device=device)
+    return (positions >= starts_tensor) & (positions < lengths.unsqueeze(1) - 1)
+
+
+def _gather_nlps(
+    model: Model, outputs: torch.Tensor, target_ids: torch.Tensor
+) -> torch.Tensor:
+    """Calculate the nlp of the target token at each position in batch.
+
+    The positions are processed in chunks,
+    so that the log-softmax never holds the logits of the whole batch at once,
+    which caps its peak memory.
+    In the lean mode, the logits are computed from the hidden states per chunk.
+    """
+    flat_outputs = outputs.reshape(-1, outputs.shape[-1])
+    flat_ids = target_ids.reshape(-1, 1)
+    chunks = [
+        -torch.log_softmax(_to_logits(model, chunk), dim=-1).gather(-1, ids)
+        for chunk, ids in zip(
+            flat_outputs.split(_LOGITS_CHUNK_SIZE), flat_ids.split(_LOGITS_CHUNK_SIZE)
+        )
+    ]
+    return torch.cat(chunks).view(target_ids.shape)
+
+
+def _to_logits(model: Model, outputs: torch.Tensor) -> torch.Tensor:
+    """Turn the outputs of the forward pass into logits."""
+    if not _is_lean(model):
+        return outputs
+    lm_head = model.model.get_output_embeddings()
+    with torch.no_grad():
+        # the model would also compute the logits in float32
+        return lm_head(outputs).float()
+
+
+def _is_lean(model: Model) -> bool:
+    """Return whether the LM head is applied separately from the forward pass."""
+    return (
+        Config.scoring_mode == "lean"
+        and model.model.get_output_embeddings() is not None
+    )
+
 
-    The i-th logits are derived from the i-th token.
-    The logits tensor does not need to be trimmed to match the input_ids.
+def _forward(
+    model: Model, model_inputs: Dict[str, Any]
+) -> Tuple[torch.Tensor, Optional[caching.Cache]]:
+    """Run the model on the inputs. Return the outputs and the cache.
+
+    In the lean mode, the outputs are the last hidden states.
+    Otherwise, they are the logits.
     """
-    # prediction for a token is in the previous position
-    text_ids = input_ids[1:]
-    nlps = infer_nlps_from_logits(text_ids, logits)
-    return nlps.sum().item()
+    with torch.no_grad():
+        if _is_lean(model):
+            outputs = model.model.base_model(**model_inputs, return_dict=True)
+            return outputs.last_hidden_state, outputs.past_key_values
+        outputs = model.model(**model_inputs, return_dict=True)
+        return outputs.logits, outputs.past_key_values
 
 
 def _get_outputs_with_cache(
     model: Model,
     input_ids: torch.Tensor,
-    caches: List[Optional[caching.LazyCache]]
+    cache_batch: Optional[caching.Cache]
 ) -> Tuple[torch.Tensor, List[caching.Cache]]:
     """Prepare inputs and get outputs from the model. Use the cache."""
-    cache_batch = caching.join_caches_optional(caches)
     model_kwargs = {
         "use_cache": True,
         "past_key_values": cache_batch,
@@ -110,6 +439,5 @@ def _get_outputs_with_cache(
     model_inputs = model.model.prepare_inputs_for_generation(
         input_ids, **model_kwargs
     )
-    with torch.no_grad():
-        outputs = model.model(**model_inputs, return_dict=True)
-    return outputs.logits, caching.split_cache(outputs.past_key_values)
+    outputs, cache = _forward(model, model_inputs)
+    return outputs, caching.split_cache(cache)
@@ -0,0 +1,64 @@
+"""This module stores generated word forms in an index on disk.
+
+The index holds the paradigms of frequent lemmas,
+so that they do not need to be generated again.
+Each line holds a lemma, a tag wildcard and the forms, separated by tabs.
+The file is memory-mapped, only the positions of the lines are read at startup.
+"""
+
+import mmap
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+
+class ParadigmIndex:
+    """The forms of lemmas matching tag wildcards, read from a file."""
+
+    def __init__(self, data: Union[bytes, mmap.mmap]) -> None:
+        self._data = data
+        # the start and end of the forms for each lemma and wildcard
+        self._positions: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        start = 0
+        while start < len(data):
+            end = data.find(b"\n", start)
+            if end == -1:
+                end = len(data)
+            lemma_end = data.find(b"\t", start, end)
+            wildcard_end = data.find(b"\t", lemma_end + 1, end)
+            if wildcard_end == -1:  # no forms
+                wildcard_end = end
+            key = (
+                data[start:lemma_end].decode(),
+                data[lemma_end + 1:wildcard_end].decode(),
+            )
+            self._positions[key] = (min(wildcard_end + 1, end), end)
+            start = end + 1
+
+    @classmethod
+    def load(cls, path: str) -> "ParadigmIndex":
+        """Memory-map the index from the file."""
+        with open(path, "rb") as file:
+            if file.seek(0, 2) == 0:
+                return cls(b"")  # an empty file cannot be mapped
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def get(self, lemma: str, wildcard: str) -> Optional[Tuple[str, ...]]:
+        """Return the forms, or None if the index does not have them."""
+        positions = self._positions.get((lemma, wildcard))
+        if positions is None:
+            return None
+        start, end = positions
+        if start == end:
+            return ()
+        return tuple(self._data[start:end].decode().split("\t"))
+
+
+def write_index(
+    path: str, paradigms: Iterable[Tuple[str, str, Iterable[str]]]
+) -> None:
+    """Write the lemmas, wildcards and their forms to an index file."""
+    with open(path, "w", encoding="utf-8") as file:
+        for lemma, wildcard, forms in paradigms:
+            file.write("\t".join([lemma, wildcard, *forms]) + "\n")
@@ -0,0 +1,134 @@
+"""This module batches concurrent prediction requests.
+
+Requests that arrive within a short window are decoded together,
+which uses the model better than decoding them one by one.
+"""
+
+import concurrent.futures
+import dataclasses
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from preditor.cancellation import Cancelled, CancelToken
+from preditor.model.model import Model
+from preditor.prediction import confidence
+from preditor.prediction.config import PredictionConfig
+from preditor.prediction.prediction import BatchPredictFunc
+from preditor.sessions import PrefixCache
+
+
+@dataclasses.dataclass(frozen=True)
+class _PendingPrediction:
+    """A prediction request waiting to be processed."""
+
+    model: Model
+    text: str
+    config: PredictionConfig
+    prefix_cache: Optional[PrefixCache]
+    cancel_token: Optional[CancelToken]
+    future: "concurrent.futures.Future[str]"
+
+
+class PredictionScheduler:
+    """Collect concurrent prediction requests and process them in batches.
+
+    The batch is processed once it is full
+    or once the first request in it has waited long enough.
+    """
+
+    def __init__(
+        self, max_batch_size: int, max_wait_ms: float,
+        func: BatchPredictFunc = confidence.generate_batch,
+    ) -> None:
+        self._max_batch_size = max(max_batch_size, 1)
+        self._max_wait = max_wait_ms / 1000
+        self._func = func
+        self._queue: "queue.Queue[_PendingPrediction]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def generate(
+        self, model: Model, input_text: str, config: PredictionConfig,
+        prefix_cache: Optional[PrefixCache] = None,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> str:
+        """Generate a continuation of the input text.
+
+        Block until the batch containing the request is processed.
+        The signature matches PredictFunc.
+        If the cancel token is cancelled, raise Cancelled.
+        """
+        # the worker is started lazily so that it runs in the process
+        # that handles the requests, not in a parent that forks workers
+        self._ensure_worker()
+        future: "concurrent.futures.Future[str]" = concurrent.futures.Future()
+        self._queue.put(_PendingPrediction(
+            model, input_text, config, prefix_cache, cancel_token, future
+        ))
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        """Start the worker thread if it is not running."""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        """Process the batches forever."""
+        while True:
+            self._process(self._collect_batch())
+
+    def _collect_batch(self) -> List[_PendingPrediction]:
+        """Wait for the first request, then gather more until the deadline."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch: List[_PendingPrediction]) -> None:
+        """Process the batch and pass the outputs to the waiting requests."""
+        # only requests for the same model can share a batch
+        groups: Dict[int, List[_PendingPrediction]] = {}
+        for pending in batch:
+            if _is_cancelled(pending):
+                pending.future.set_exception(Cancelled())
+                continue
+            groups.setdefault(id(pending.model), []).append(pending)
+        for group in groups.values():
+            self._process_group(group)
+
+    def _process_group(self, group: List[_PendingPrediction]) -> None:
+        """Process requests for the same model."""
+        try:
+            outputs = self._func(
+                group[0].model,
+                [pending.text for pending in group],
+                [pending.config for pending in group],
+                [pending.prefix_cache for pending in group],
+                [pending.cancel_token for pending in group],
+            )
+        except Exception as e:
+            for pending in group:
+                pending.future.set_exception(e)
+            return
+        for pending, output in zip(group, outputs):
+            if _is_cancelled(pending):
+                # the output is incomplete
+                pending.future.set_exception(Cancelled())
+            else:
+                pending.future.set_result(output)
+
+
+def _is_cancelled(pending: _PendingPrediction) -> bool:
+    """Check whether the request was cancelled."""
+    return pending.cancel_token is not None and pending.cancel_token.cancelled
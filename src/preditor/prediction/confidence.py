@@ -4,26 +4,81 @@ It finds the optimal place to cut off the generated text.
 """
 
 import math
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 
 import torch
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
 
-from preditor import nlp
+from preditor import caching, nlp
+from preditor.cancellation import CancelToken, get_stopping_criteria
 from preditor.model.model import Model
 from preditor.prediction.config import PredictionConfig
+from preditor.sessions import PrefixCache
 from preditor.suggestion import generation
 
 
-def generate(model: Model, input_text: str, config: PredictionConfig) -> str:
+def generate(
+    model: Model, input_text: str, config: PredictionConfig,
+    prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
+    streamer: Optional[BaseStreamer] = None,
+) -> str:
     """Generate a continuation of the input text.
 
     Trim the generated text to only include the tokens
     where the model is confident enough.
     The higher the confidence parameter, the longer the output.
+    If a prefix cache is given, reuse the attention cache of the previous prompt.
+    If the cancel token is cancelled, stop and raise Cancelled.
+    If a streamer is given, it receives the tokens as they are generated,
+    before the output is trimmed.
     """
     text_stripped = input_text.rstrip()
     had_trailing_space = input_text != text_stripped
-    gen_ids, logits = _get_model_outputs(model, text_stripped, had_trailing_space, config)
+    gen_ids, logits = _get_model_outputs(
+        model, text_stripped, had_trailing_space, config,
+        prefix_cache, cancel_token, streamer
+    )
+    return _select_output(model, gen_ids, logits, had_trailing_space, config)
+
+
+def generate_batch(
+    model: Model, input_texts: List[str], configs: List[PredictionConfig],
+    prefix_caches: Optional[List[Optional[PrefixCache]]] = None,
+    cancel_tokens: Optional[List[Optional[CancelToken]]] = None,
+) -> List[str]:
+    """Generate continuations of several input texts at once.
+
+    The texts are left-padded and decoded in a single batch.
+    Each output is the same as if the text was processed alone.
+    The outputs of cancelled texts are incomplete.
+    """
+    if prefix_caches is None:
+        prefix_caches = [None] * len(input_texts)
+    if cancel_tokens is None:
+        cancel_tokens = [None] * len(input_texts)
+    texts_stripped = [text.rstrip() for text in input_texts]
+    had_trailing_spaces = [
+        text != stripped
+        for text, stripped in zip(input_texts, texts_stripped)
+    ]
+    outputs = _get_model_outputs_batch(
+        model, texts_stripped, had_trailing_spaces, configs,
+        prefix_caches, cancel_tokens
+    )
+    return [
+        _select_output(model, gen_ids, logits, had_trailing_space, config)
+        for (gen_ids, logits), had_trailing_space, config
+        in zip(outputs, had_trailing_spaces, configs)
+    ]
+
+
+def _select_output(
+    model: Model, gen_ids: torch.Tensor, logits: torch.Tensor,
+    had_trailing_space: bool, config: PredictionConfig
+) -> str:
+    """Cut off the generated text where the expected usefulness is highest."""
     nlps = nlp.infer_nlps_from_logits(gen_ids, logits).tolist()
     # expected[i] is the expected usefulness of the prefix of length i
     expected = _calculate_expected_usefulness(nlps, config.confidence)
@@ -36,26 +91,173 @@ def generate(model: Model, input_text: str, config: PredictionConfig) -> str:
 
 def _get_model_outputs(
     model: Model, text_stripped: str, had_trailing_space: bool,
-    config: PredictionConfig
+    config: PredictionConfig, prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
+    streamer: Optional[BaseStreamer] = None,
+    early_stopping: bool = True,
 ) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Generate the continuation ids and logits."""
+    """Generate the continuation ids and logits.
+
+    With early stopping, the generation ends once no longer output
+    can be more useful, so the result may be shorter than max_length.
+    """
     input_ids = generation.encode_with_eos(model, text_stripped).to(model.device)
     processors = generation.get_suppress_processors(
-        model.tokenizer, had_trailing_space, len(input_ids[0]), []
+        model.tokenizer, had_trailing_space, len(input_ids[0])
     )
+    past_key_values = None
+    if prefix_cache is not None:
+        past_key_values, _ = prefix_cache.lookup(input_ids[0])
+    stopping_criteria = get_stopping_criteria([cancel_token])
+    if early_stopping:
+        stopping_criteria.append(UsefulnessStoppingCriteria([config]))
     output = model.model.generate(
         input_ids,
+        past_key_values=past_key_values,
         logits_processor=processors,
+        stopping_criteria=stopping_criteria,
+        streamer=streamer,
         generation_config=model.config,
         max_new_tokens=config.max_length,
         output_scores=True,
         return_dict_in_generate=True,
     )
+    if prefix_cache is not None:
+        prefix_cache.update(input_ids[0], output.past_key_values)
+    if cancel_token is not None:
+        cancel_token.check()
     gen_ids = output.sequences[0][len(input_ids[0]):]
     logits = torch.stack(output.scores).squeeze(1).to(torch.float64)
     return gen_ids, logits
 
 
+def _get_model_outputs_batch(
+    model: Model, texts_stripped: List[str], had_trailing_spaces: List[bool],
+    configs: List[PredictionConfig], prefix_caches: List[Optional[PrefixCache]],
+    cancel_tokens: List[Optional[CancelToken]]
+) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """Generate the continuation ids and logits for a batch of texts."""
+    input_ids_list = [
+        generation.encode_with_eos(model, text)[0].to(model.device)
+        for text in texts_stripped
+    ]
+    input_ids, attention_mask = generation.left_pad(
+        input_ids_list, model.config.pad_token_id
+    )
+    input_len = input_ids.shape[1]
+    past_key_values = _join_prefix_caches(input_ids_list, input_len, prefix_caches)
+    processors = generation.get_batch_suppress_processors(
+        model.tokenizer, had_trailing_spaces, input_len
+    )
+    usefulness_criteria = UsefulnessStoppingCriteria(configs)
+    stopping_criteria = get_stopping_criteria(cancel_tokens)
+    stopping_criteria.append(usefulness_criteria)
+    output = model.model.generate(
+        input_ids.to(model.device),
+        attention_mask=attention_mask.to(model.device),
+        past_key_values=past_key_values,
+        logits_processor=processors,
+        stopping_criteria=stopping_criteria,
+        generation_config=model.config,
+        max_new_tokens=max(config.max_length for config in configs),
+        output_scores=True,
+        return_dict_in_generate=True,
+    )
+    row_caches = caching.split_cache(output.past_key_values)
+    for ids, prefix_cache, row_cache in zip(input_ids_list, prefix_caches, row_caches):
+        if prefix_cache is not None:
+            pad = input_len - len(ids)
+            prefix_cache.update(ids, caching.trim_cache(row_cache, pad, input_len))
+    gen_ids_batch = output.sequences[:, input_len:]
+    logits_batch = torch.stack(output.scores, dim=1).to(torch.float64)
+    result: List[Tuple[torch.Tensor, torch.Tensor]] = []
+    for gen_ids, logits, num_steps in zip(
+        gen_ids_batch, logits_batch, usefulness_criteria.num_steps
+    ):
+        length = _generated_length(gen_ids, model.config.eos_token_id, num_steps)
+        result.append((gen_ids[:length], logits[:length]))
+    return result
+
+
+def _join_prefix_caches(
+    input_ids_list: List[torch.Tensor], input_len: int,
+    prefix_caches: List[Optional[PrefixCache]]
+) -> Optional[caching.Cache]:
+    """Join the cached prefixes of left-padded inputs into one cache.
+
+    Each cache is shifted right by the padding of its input.
+    The joint cache only reaches as far as the shortest of the shifted caches.
+    """
+    found = [
+        prefix_cache.lookup(ids) if prefix_cache is not None else (None, 0)
+        for ids, prefix_cache in zip(input_ids_list, prefix_caches)
+    ]
+    pads = [input_len - len(ids) for ids in input_ids_list]
+    length = min(pad + cache_len for pad, (_, cache_len) in zip(pads, found))
+    template = next((cache for cache, _ in found if cache is not None), None)
+    if length == 0 or template is None:
+        return None
+    shifted = [
+        # missing caches are only padding within the joint length
+        caching.shift_cache(cache if cache is not None else template, pad, length)
+        for (cache, _), pad in zip(found, pads)
+    ]
+    return caching.join_caches([
+        caching.LazyCache(cache, length) for cache in shifted
+    ])
+
+
+def _generated_length(
+    gen_ids: torch.Tensor, eos_token_id: Optional[Union[int, List[int]]],
+    max_length: int
+) -> int:
+    """Find how many tokens would have been generated for the text alone.
+
+    If the generation stops at EOS, the rest of the row is padding.
+    """
+    if eos_token_id is None:
+        return max_length
+    eos_ids = torch.tensor(eos_token_id, device=gen_ids.device)
+    eos_positions = torch.isin(gen_ids, eos_ids).nonzero()
+    if len(eos_positions) > 0:
+        max_length = min(max_length, eos_positions[0].item() + 1)
+    return max_length
+
+
+class UsefulnessStoppingCriteria(StoppingCriteria):
+    """Stop once no longer prefix can be more useful than the best one so far.
+
+    The negative log probability of a prefix never decreases
+    as more tokens are generated.
+    Therefore, the expected usefulness of any longer prefix is at most
+    max_length times the probability of the current prefix.
+    The rows of the batch are tracked separately.
+    """
+
+    def __init__(self, configs: List[PredictionConfig]) -> None:
+        self.configs = configs
+        self.num_steps = [0] * len(configs)
+        self._prefix_nlps = [0.0] * len(configs)
+        self._best = [0.0] * len(configs)
+        self._done = [False] * len(configs)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Tuple[torch.Tensor, ...], **kwargs) -> torch.BoolTensor:
+        # computed the same way as in _select_output so that the results match
+        logits = scores[-1].to(torch.float64)
+        token_nlps = nlp.infer_nlps_from_logits(input_ids[:, -1], logits).tolist()
+        for i, (config, token_nlp) in enumerate(zip(self.configs, token_nlps)):
+            if self._done[i]:
+                continue
+            self.num_steps[i] += 1
+            self._prefix_nlps[i] += token_nlp
+            probability = math.exp(-self._prefix_nlps[i] / config.confidence)
+            self._best[i] = max(self._best[i], self.num_steps[i] * probability)
+            upper_bound = config.max_length * probability
+            if upper_bound <= self._best[i] or self.num_steps[i] >= config.max_length:
+                self._done[i] = True
+        return torch.tensor(self._done, device=input_ids.device)
+
+
 def _calculate_expected_usefulness(
     nlps: List[float], confidence: float
 ) -> List[float]:
@@ -1,12 +1,21 @@
 """This module is the entry point for the prediction task."""
 
-from typing import Callable
+from typing import Callable, List, Optional
 
+from preditor.cancellation import CancelToken
 from preditor.model.model import Model
 from preditor.prediction import confidence
 from preditor.prediction.config import PredictionConfig
+from preditor.sessions import PrefixCache
 
 PredictFunc = Callable[[Model, str, PredictionConfig], str]
+BatchPredictFunc = Callable[
+    [
+        Model, List[str], List[PredictionConfig],
+        List[Optional[PrefixCache]], List[Optional[CancelToken]]
+    ],
+    List[str]
+]
 
 
 def predict(
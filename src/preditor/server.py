@@ -4,28 +4,52 @@ It provides a REST API for the individual tasks.
 """
 
 import abc
-from typing import Any, Type
+import concurrent.futures
+import functools
+import json
+import threading
+from typing import Any, Dict, Iterator, Optional, Type
 
 import flask
 import pydantic
+from transformers import TextIteratorStreamer
 
+from preditor import cancellation, sessions
 from preditor.config import Config
-from preditor.infilling import infilling
+from preditor.infilling import blank, end, infilling, selection
 from preditor.model.hf import HFModel
-from preditor.prediction import prediction
-from preditor.substitution import substitution
-from preditor.suggestion import suggestion
+from preditor.prediction import batching, confidence, prediction
+from preditor.substitution import dijkstra, engine, substitution
+from preditor.suggestion import generation, suggestion
 
 app = flask.Flask(__name__)
 model = HFModel(Config.model_path)
+# load the masks of the vocabulary before the first request needs them
+generation.get_mask_without_prefix_space(model.tokenizer)
+blank.get_blank_mask(model.tokenizer)
+if Config.prediction_batch_size > 1:
+    scheduler = batching.PredictionScheduler(
+        Config.prediction_batch_size, Config.prediction_batch_wait_ms
+    )
+    predict_func: prediction.PredictFunc = scheduler.generate
+else:
+    predict_func = confidence.generate
+if Config.substitution_interleave:
+    substitution_engine = engine.SubstitutionEngine()
+    substitute_func: substitution.SubstituteFunc = substitution_engine.replace
+else:
+    substitute_func = dijkstra.replace_with_cache
+prefix_caches = sessions.PrefixCacheStore(Config.session_cache_mb * 2**20)
+in_flight = cancellation.InFlightRequests()
+SUPERSEDED_BODY = {"error": "Request superseded", "status": "superseded"}
 
 
 class PreditorRequest(pydantic.BaseModel, abc.ABC):
     """Interface for a request to the Preditor API."""
 
     @abc.abstractmethod
-    def handle(self) -> str:
-        """Handle the request and return the output."""
+    def handle(self) -> Dict[str, Any]:
+        """Handle the request and return the response body."""
         pass
 
 
@@ -33,35 +57,121 @@ class SuggestionRequest(PreditorRequest):
     """Request for a suggestion.
 
     It combines the prediction and infilling tasks.
+    Requests with the same session id reuse the work done for the previous one.
+    A new request in the session cancels the running one.
     """
 
     before_cursor: str
     after_cursor: str
     prediction_config: prediction.PredictionConfig = prediction.PredictionConfig()
     infilling_config: infilling.InfillingConfig = infilling.InfillingConfig()
-
-    def handle(self) -> str:
-        return suggestion.suggest(
-            model, self.before_cursor, self.after_cursor,
-            self.prediction_config, self.infilling_config
+    session_id: Optional[str] = None
+
+    def handle(self) -> Dict[str, Any]:
+        return {"output": self._suggest(predict_func)}
+
+    def stream(self) -> Iterator[str]:
+        """Handle the request and stream the prediction as it is generated.
+
+        Yield server-sent events.
+        The decoded text is sent in token events as soon as it is generated,
+        the final output is sent in an output event.
+        If the suggestion fails, an error event is sent instead.
+        Infilling is not streamed, it only sends the output event.
+        """
+        streamer = TextIteratorStreamer(
+            model.tokenizer, skip_prompt=True, skip_special_tokens=True
         )
+        # batched prediction cannot stream, decode the request on its own
+        streaming_predict = functools.partial(confidence.generate, streamer=streamer)
+        result: "concurrent.futures.Future[str]" = concurrent.futures.Future()
+
+        def run() -> None:
+            try:
+                result.set_result(self._suggest(streaming_predict))
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                # infilling does not use the streamer, so it would never end
+                streamer.end()
+
+        threading.Thread(target=run, daemon=True).start()
+        for text in streamer:
+            if text:
+                yield _format_event("token", {"text": text})
+        # the headers are already sent, so errors end the stream with an event
+        try:
+            output = result.result()
+        except cancellation.Cancelled:
+            yield _format_event("error", SUPERSEDED_BODY)
+            return
+        except Exception as e:
+            yield _format_event("error", {"error": str(e)})
+            return
+        yield _format_event("output", {"output": output})
+
+    def _suggest(self, predict: prediction.PredictFunc) -> str:
+        """Get the suggestion, using the given function for prediction."""
+        if self.session_id is None:
+            return suggestion.suggest(
+                model, self.before_cursor, self.after_cursor,
+                self.prediction_config, self.infilling_config,
+                predict
+            )
+        # the prompts of the tasks differ, each needs its own cache
+        prediction_cache = prefix_caches.get((self.session_id, "prediction"))
+        infilling_cache = prefix_caches.get((self.session_id, "infilling"))
+        # selection scores the plain text, not the prompt of infilling
+        selection_cache = prefix_caches.get((self.session_id, "selection"))
+        with in_flight.track((self.session_id, "suggest")) as cancel_token:
+            return suggestion.suggest(
+                model, self.before_cursor, self.after_cursor,
+                self.prediction_config, self.infilling_config,
+                functools.partial(
+                    predict,
+                    prefix_cache=prediction_cache, cancel_token=cancel_token
+                ),
+                functools.partial(
+                    end.generate_infills,
+                    prefix_cache=infilling_cache, cancel_token=cancel_token
+                ),
+                functools.partial(
+                    selection.select_by_score, prefix_cache=selection_cache
+                ),
+            )
 
 
 class SubstitutionRequest(PreditorRequest):
-    """Request for a substitution of a word in a sentence."""
+    """Request for a substitution of a word in a sentence.
+
+    A new request in the session cancels the running one.
+    The response says whether the output is exact,
+    it is not if the search did not finish before the deadline.
+    """
 
     before_old: str
     old: str
     after_old: str
     replacement: str
     config: substitution.SubstitutionConfig = substitution.SubstitutionConfig()
-
-    def handle(self) -> str:
-        return substitution.replace(
-            model,
-            self.before_old, self.old, self.after_old, self.replacement,
-            self.config
-        )
+    session_id: Optional[str] = None
+
+    def handle(self) -> Dict[str, Any]:
+        if self.session_id is None:
+            result = substitution.replace(
+                model,
+                self.before_old, self.old, self.after_old, self.replacement,
+                self.config, substitute_func
+            )
+        else:
+            with in_flight.track((self.session_id, "substitute")) as cancel_token:
+                result = substitution.replace(
+                    model,
+                    self.before_old, self.old, self.after_old, self.replacement,
+                    self.config,
+                    functools.partial(substitute_func, cancel_token=cancel_token)
+                )
+        return {"output": result.text, "exact": result.exact}
 
 
 @app.route("/")
@@ -77,6 +187,17 @@ def suggest() -> flask.Response:
     return _handle_request(request, SuggestionRequest)
 
 
+@app.route("/suggest/stream/", methods=["POST"])
+def suggest_stream() -> flask.Response:
+    """Dispatch a suggestion request and stream the output as server-sent events."""
+    data: Any = flask.request.get_json()
+    try:
+        request = SuggestionRequest(**data)
+    except pydantic.ValidationError as e:
+        return _build_validation_error_response(e)
+    return flask.Response(request.stream(), mimetype="text/event-stream")
+
+
 @app.route("/substitute/", methods=["POST"])
 def substitute() -> flask.Response:
     """Dispatch a substitution request."""
@@ -89,10 +210,20 @@ def _handle_request(data: Any, request_cls: Type[PreditorRequest]) -> flask.Resp
     try:
         request = request_cls(**data)
     except pydantic.ValidationError as e:
-        details = e.errors(include_input=False, include_url=False)
-        return _build_error_response("Invalid request data", details)
-    output = request.handle()
-    return flask.jsonify({"output": output})
+        return _build_validation_error_response(e)
+    try:
+        body = request.handle()
+    except cancellation.Cancelled:
+        response = flask.jsonify(SUPERSEDED_BODY)
+        response.status_code = 409
+        return response
+    return flask.jsonify(body)
+
+
+def _build_validation_error_response(e: pydantic.ValidationError) -> flask.Response:
+    """Create a response describing invalid request data."""
+    details = e.errors(include_input=False, include_url=False)
+    return _build_error_response("Invalid request data", details)
 
 
 def _build_error_response(msg: str, details: Any = None) -> flask.Response:
@@ -103,3 +234,8 @@ def _build_error_response(msg: str, details: Any = None) -> flask.Response:
     response = flask.jsonify(body)
     response.status_code = 400
     return response
+
+
+def _format_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event with JSON data."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
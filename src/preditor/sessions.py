@@ -0,0 +1,108 @@
+"""This module keeps the attention caches of previous requests in a session.
+
+While the user types, consecutive requests share most of the prompt.
+The cache of the previous prompt can be reused,
+so that only the newly typed tokens need to be processed.
+"""
+
+import collections
+import dataclasses
+import threading
+from typing import Hashable, Optional, Tuple
+
+import torch
+
+from preditor import caching
+
+
+@dataclasses.dataclass(frozen=True)
+class _Entry:
+    """The cache of the last prompt in a session."""
+
+    input_ids: torch.Tensor
+    cache: caching.Cache
+    nbytes: int
+
+
+class PrefixCacheStore:
+    """Keep the attention cache of the last prompt of each session.
+
+    The least recently used caches are evicted
+    when their total size exceeds the memory budget.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._entries: "collections.OrderedDict[Hashable, _Entry]" = collections.OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> "PrefixCache":
+        """Return a handle to the cache with the given key."""
+        return PrefixCache(self, key)
+
+    def lookup(
+        self, key: Hashable, input_ids: torch.Tensor
+    ) -> Tuple[Optional[caching.Cache], int]:
+        """Find the cache of the longest common prefix with the stored prompt.
+
+        The last input token is never taken from the cache,
+        so that the model always has something to process.
+        Return the cache and its length.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, 0
+            self._entries.move_to_end(key)
+        length = _common_prefix_len(entry.input_ids, input_ids)
+        length = min(length, len(input_ids) - 1)
+        if length <= 0:
+            return None, 0
+        return caching.trim_cache(entry.cache, 0, length), length
+
+    def update(
+        self, key: Hashable, input_ids: torch.Tensor, cache: caching.Cache
+    ) -> None:
+        """Store the cache of the prompt, replacing the previous one.
+
+        The cache starts with the prompt, the rest of it is dropped.
+        """
+        owned = caching.copy_cache(caching.trim_cache(cache, 0, len(input_ids)))
+        entry = _Entry(input_ids.clone(), owned, caching.cache_nbytes(owned))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous.nbytes
+            if entry.nbytes > self._max_bytes:
+                return
+            self._entries[key] = entry
+            self._total_bytes += entry.nbytes
+            while self._total_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+
+@dataclasses.dataclass(frozen=True)
+class PrefixCache:
+    """A handle to the cache of one session in the store."""
+
+    store: PrefixCacheStore
+    key: Hashable
+
+    def lookup(self, input_ids: torch.Tensor) -> Tuple[Optional[caching.Cache], int]:
+        """Find the cache of the longest common prefix with the stored prompt."""
+        return self.store.lookup(self.key, input_ids)
+
+    def update(self, input_ids: torch.Tensor, cache: caching.Cache) -> None:
+        """Store the cache of the prompt, replacing the previous one."""
+        self.store.update(self.key, input_ids, cache)
+
+
+def _common_prefix_len(a: torch.Tensor, b: torch.Tensor) -> int:
+    """Return the length of the common prefix of two 1D tensors."""
+    length = min(len(a), len(b))
+    mismatches = (a[:length] != b[:length].to(a.device)).nonzero()
+    if len(mismatches) > 0:
+        return int(mismatches[0].item())
+    return length
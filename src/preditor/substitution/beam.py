@@ -0,0 +1,56 @@
+"""This module implements the beam strategy.
+
+It goes through the forms from left to right and keeps a fixed number
+of the best texts, which bounds both the forward passes and the memory.
+"""
+
+import heapq
+from typing import Optional
+
+from preditor.cancellation import CancelToken
+from preditor.model.model import Model
+from preditor.substitution import expansion
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchResult, SearchSteps
+from preditor.substitution.variants import ReplacementVariantsGenerator
+
+
+def replace(
+    model: Model,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cancel_token: Optional[CancelToken] = None,
+) -> SearchResult:
+    """Find best replacement using beam search. See search."""
+    return expansion.run_steps(model, search(model, rvg, config, cancel_token))
+
+
+def search(
+    model: Model,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cancel_token: Optional[CancelToken] = None,
+) -> SearchSteps:
+    """Run the steps of the beam search.
+
+    All texts in the beam end at the same form, so in each step,
+    the extensions of all of them are scored at once.
+    Only the caches of the texts in the beam are kept.
+    The number of steps is bounded by the forms,
+    so config.deadline_ms is ignored.
+    If the cancel token is cancelled, stop and raise Cancelled.
+    """
+    cache_manager = expansion.create_cache_manager(model, config)
+    beam = [expansion.create_start_node(model)]
+    while beam[0].num_forms < rvg.num_forms:
+        if cancel_token is not None:
+            cancel_token.check()
+        cache_manager.use(node.cache for node in beam)
+        relaxed = yield from expansion.relax_nodes(
+            model, beam, rvg, config.min_variants, cache_manager
+        )
+        cache_manager.release(node.cache for node in beam)
+        beam = heapq.nsmallest(config.beam_width, relaxed, key=config.score_key)
+        kept_ids = {id(node) for node in beam}
+        cache_manager.release(node.cache for node in relaxed if id(node) not in kept_ids)
+    return SearchResult(beam[0].text)
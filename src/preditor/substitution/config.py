@@ -1,5 +1,7 @@
 """This module provides configuration for the substitution algorithms."""
 
+from typing import Optional
+
 import pydantic
 
 from preditor.substitution.search import ScoreKey, lp_key
@@ -13,6 +15,13 @@ class SubstitutionConfig(pydantic.BaseModel):
     pool_factor: What multiple of relax_count to use as the pool size
         for node selection.
     lp_alpha: The exponent in the length penalty function.
+    beam_width: The number of texts kept by the beam strategy.
+    quantize_cache: Whether to store the attention caches of the search
+        in 8 bits, which saves memory at a small cost in accuracy.
+    deadline_ms: The time limit of the search in milliseconds, or None.
+        When it is reached, the best open texts are completed unchanged
+        and the best of them is returned as an approximate result.
+        Only the Dijkstra strategies with caches keep the limit.
     """
 
     min_variants: int = pydantic.Field(2, ge=2)
@@ -20,6 +29,9 @@ class SubstitutionConfig(pydantic.BaseModel):
     pool_factor: int = pydantic.Field(5, ge=1)
     # no need to select score key, 0.0 yields same behavior as nlp_key
     lp_alpha: float = pydantic.Field(0.0, ge=0.0, le=1.0)
+    beam_width: int = pydantic.Field(4, ge=1)
+    quantize_cache: bool = False
+    deadline_ms: Optional[int] = pydantic.Field(None, ge=1)
 
     @property
     def score_key(self) -> ScoreKey:
@@ -3,13 +3,17 @@
 It searches the implicit graph of all sentence variants.
 """
 
-import heapq
-from typing import Iterable, List
+import time
+from typing import List, Optional
 
-from preditor import nlp
+from preditor import caching, nlp
+from preditor.cancellation import CancelToken
 from preditor.model.model import Model
+from preditor.substitution import expansion
 from preditor.substitution.config import SubstitutionConfig
-from preditor.substitution.search import ScoreKey, SearchNode
+from preditor.substitution.search import (
+    OpenSet, ScoreKey, SearchNode, SearchResult, SearchSteps
+)
 from preditor.substitution.variants import ReplacementVariantsGenerator
 
 
@@ -17,24 +21,19 @@ def replace(
     model: Model,
     rvg: ReplacementVariantsGenerator,
     config: SubstitutionConfig,
-) -> str:
+) -> SearchResult:
     """Find best replacement using Dijkstra-inspired approach.
 
     Scores many texts at once to speed up the search.
     """
-    start_node = SearchNode("", 0, 0)
-    open_nodes = {start_node}
+    open_nodes = OpenSet(config.score_key, rvg.num_forms)
+    open_nodes.update([SearchNode("", 0, 0)])
 
     while True:
-        best = min(open_nodes, key=config.score_key)
+        best = open_nodes.best()
         if best.num_forms == rvg.num_forms:
-            return best.text
-        unfinished = (
-            node for node in open_nodes
-            if node.num_forms < rvg.num_forms
-        )
-        to_relax = heapq.nsmallest(config.relax_count, unfinished, key=config.score_key)
-        open_nodes.difference_update(to_relax)
+            return SearchResult(best.text)
+        to_relax = open_nodes.pop_unfinished(config.relax_count)
         relaxed = _relax_nodes(model, to_relax, rvg, config.min_variants)
         open_nodes.update(relaxed)
 
@@ -43,7 +42,7 @@ def replace_baseline(
     model: Model,
     rvg: ReplacementVariantsGenerator,
     config: SubstitutionConfig,
-) -> str:
+) -> SearchResult:
     """Find best replacement using Dijkstra-inspired approach.
 
     Keep track of the best NLP for each word. Calculate the score as the
@@ -86,48 +85,165 @@ def replace_baseline(
         best_nlp_diff = min(new_nlps) - current.nlp
         update_baselines(current.num_forms, extension_end, best_nlp_diff)
 
-    return min(finished_nodes, key=baseline_key).text
+    return SearchResult(min(finished_nodes, key=baseline_key).text)
 
 
 def replace_with_cache(
     model: Model,
     rvg: ReplacementVariantsGenerator,
     config: SubstitutionConfig,
-) -> str:
+    cancel_token: Optional[CancelToken] = None,
+) -> SearchResult:
     """Find best replacement using Dijkstra-inspired approach.
 
     Caches the NLP scores to avoid redundant calculations.
+    See search_with_cache.
     """
-    start_node = SearchNode("", 0, 0, None)
-    open_nodes = {start_node}
+    return expansion.run_steps(
+        model, search_with_cache(model, rvg, config, cancel_token)
+    )
+
+
+def search_with_cache(
+    model: Model,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cancel_token: Optional[CancelToken] = None,
+    prune: bool = False,
+) -> SearchSteps:
+    """Run the steps of the Dijkstra-inspired search with the cache.
+
+    The texts are tokenized incrementally, only at the seams of the extensions.
+    The caches are kept within a memory budget,
+    the dropped ones are recomputed.
+    With pruning, the nodes that cannot end up best are dropped, see _prune.
+    If the deadline of the config passes, return an approximate result.
+    If the cancel token is cancelled, stop and raise Cancelled.
+    """
+    deadline = _get_deadline(config)
+    cache_manager = expansion.create_cache_manager(model, config)
+    open_nodes = OpenSet(config.score_key, rvg.num_forms)
+    open_nodes.update([expansion.create_start_node(model)])
 
     while True:
-        best = min(open_nodes, key=config.score_key)
+        if cancel_token is not None:
+            cancel_token.check()
+        best = open_nodes.best()
         if best.num_forms == rvg.num_forms:
-            return best.text
-        unfinished = (
-            node for node in open_nodes
-            if node.num_forms < rvg.num_forms
-        )
+            return SearchResult(best.text)
+        if _is_past(deadline):
+            return (yield from _finish_unchanged(
+                model, open_nodes, rvg, config, cache_manager
+            ))
+        pool = open_nodes.pop_unfinished(config.pool_size)
+        if prune:
+            pool = _prune(pool, open_nodes, rvg, config, cache_manager)
         to_relax = _select_nodes_to_relax_with_cache(
-            best, unfinished, config.relax_count, config.pool_size, config.score_key
+            best, pool, config.relax_count, config.score_key
+        )
+        # the rest of the pool stays open
+        relaxed_ids = {id(node) for node in to_relax}
+        open_nodes.update(node for node in pool if id(node) not in relaxed_ids)
+        cache_manager.use(node.cache for node in to_relax)
+        relaxed = yield from expansion.relax_nodes(
+            model, to_relax, rvg, config.min_variants, cache_manager
         )
-        open_nodes.difference_update(to_relax)
-        relaxed = _relax_nodes_with_cache(model, to_relax, rvg, config.min_variants)
+        # the relaxed nodes are closed, their caches are not needed anymore
+        cache_manager.release(node.cache for node in to_relax)
         open_nodes.update(relaxed)
 
 
+def replace_with_bound(
+    model: Model,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cancel_token: Optional[CancelToken] = None,
+) -> SearchResult:
+    """Find best replacement using A*-inspired approach with pruning.
+
+    Like replace_with_cache, but prunes the nodes that cannot end up best.
+    See search_with_cache.
+    """
+    return expansion.run_steps(
+        model, search_with_cache(model, rvg, config, cancel_token, prune=True)
+    )
+
+
+def _prune(
+    pool: List[SearchNode],
+    open_nodes: OpenSet,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cache_manager: caching.CacheManager,
+) -> List[SearchNode]:
+    """Drop the nodes of the pool that cannot end up better than a finished one.
+
+    The nlp only grows as a text is extended, so the score of a node
+    as if it were finished is a lower bound for the scores of its extensions.
+    Once a finished node is found, the nodes whose bound is not better
+    are dropped without relaxing them, and their caches are released.
+    """
+    def bound(node: SearchNode) -> float:
+        return config.score_key(node._replace(num_forms=rvg.num_forms))
+
+    finished = open_nodes.best_finished()
+    if finished is None:
+        return pool
+    # the best node is kept, its bound is not above its score
+    limit = config.score_key(finished)
+    cache_manager.release(node.cache for node in pool if bound(node) >= limit)
+    return [node for node in pool if bound(node) < limit]
+
+
+def _get_deadline(config: SubstitutionConfig) -> Optional[float]:
+    """Return the monotonic time when the search should stop, if any."""
+    if config.deadline_ms is None:
+        return None
+    return time.monotonic() + config.deadline_ms / 1000
+
+
+def _is_past(deadline: Optional[float]) -> bool:
+    """Return whether the deadline has passed."""
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _finish_unchanged(
+    model: Model,
+    open_nodes: OpenSet,
+    rvg: ReplacementVariantsGenerator,
+    config: SubstitutionConfig,
+    cache_manager: caching.CacheManager,
+) -> SearchSteps:
+    """Complete the best open nodes with the rest of the text unchanged.
+
+    The completions are scored at once, the best finished node is returned
+    as an approximate result.
+    """
+    pool = open_nodes.pop_unfinished(config.pool_size)
+    to_score = [
+        completed
+        for node in pool
+        for completed in expansion.extend_node(
+            model, node, [rvg.get_rest(node.num_forms)], rvg.num_forms
+        )
+    ]
+    cache_manager.use(node.cache for node in pool)
+    open_nodes.update((yield to_score))
+    finished = open_nodes.best_finished()
+    assert finished is not None  # the pool was not empty
+    return SearchResult(finished.text, exact=False)
+
+
 def _select_nodes_to_relax_with_cache(
     best: SearchNode,
-    unfinished: Iterable[SearchNode],
+    pool: List[SearchNode],
     relax_count: int,
-    pool_size: int,
     score_key: ScoreKey,
 ) -> List[SearchNode]:
     """Select the best nodes to relax.
 
     Always include the best node.
-    Then, create a pool of the best nodes and select a subset of them
+    Then, select a subset of the pool of the best nodes
     such that the lengths of their caches are as similar as possible.
     """
     def sort_pool(pool: List[SearchNode]) -> List[SearchNode]:
@@ -144,24 +260,26 @@ def _select_nodes_to_relax_with_cache(
     def find_most_similar_subarray(array: List[int], length: int) -> int:
         """Find a subarray such that the sum of its elements differs the least
         from its minimum multiplied by the length.
+
+        The array is sorted, so the minimum is the first element.
         """
         min_diff = sum(array)
         start_index = 0
+        subarray_sum = sum(array[:length])
         for i in range(len(array) - length + 1):
-            subarray = array[i:i+length]
-            subarray_sum = sum(subarray)
-            min_element = min(subarray)
-            diff = abs(subarray_sum - min_element * length)
+            if i > 0:
+                subarray_sum += array[i + length - 1] - array[i - 1]
+            diff = abs(subarray_sum - array[i] * length)
             if diff < min_diff:
                 min_diff = diff
                 start_index = i
         return start_index
 
-    pool = heapq.nsmallest(pool_size, unfinished, key=score_key)
     if len(pool) <= relax_count:
         return pool
     pool = sort_pool(pool)
-    best_index = pool.index(best)
+    # the nodes are not compared by value, their caches are tensors
+    best_index = next(i for i, node in enumerate(pool) if node is best)
     # ensure that the best node is included
     pool = pool[max(0, best_index - relax_count + 1):best_index + relax_count]
     lengths = [node.cache_len for node in pool]
@@ -184,25 +302,6 @@ def _relax_nodes(
     ]
 
 
-def _relax_nodes_with_cache(
-    model: Model,
-    nodes: List[SearchNode],
-    rvg: ReplacementVariantsGenerator,
-    min_variants,
-) -> List[SearchNode]:
-    """Relax nodes by scoring their extensions. Use the cache."""
-    to_score = _create_nodes_to_score(nodes, rvg, min_variants)
-    nlp_diffs, caches = nlp.infer_nlp_with_cache(
-        model,
-        [node.text for node in to_score],
-        [node.cache for node in to_score],
-    )
-    return [
-        SearchNode(node.text, node.nlp + nlp_diff, node.num_forms, cache)
-        for node, nlp_diff, cache in zip(to_score, nlp_diffs, caches)
-    ]
-
-
 def _create_nodes_to_score(
     nodes: List[SearchNode],
     rvg: ReplacementVariantsGenerator,
@@ -0,0 +1,188 @@
+"""This module runs concurrent substitution searches together.
+
+Each search is a state machine that asks for nodes to score.
+The nodes of all active searches are scored in one call,
+which uses the model better than scoring them search by search.
+The call splits the nodes into micro-batches by their cache lengths,
+so a node without a cache does not make the others recompute theirs.
+"""
+
+import concurrent.futures
+import dataclasses
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+from preditor.cancellation import CancelToken
+from preditor.model.model import Model
+from preditor.substitution import dijkstra, expansion
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchNode, SearchResult, SearchSteps
+from preditor.substitution.variants import ReplacementVariantsGenerator
+
+SearchFunc = Callable[
+    [Model, ReplacementVariantsGenerator, SubstitutionConfig, Optional[CancelToken]],
+    SearchSteps
+]
+ScoreFunc = Callable[[Model, List[SearchNode]], List[SearchNode]]
+
+
+@dataclasses.dataclass(frozen=True)
+class _PendingSearch:
+    """A search waiting to join the engine."""
+
+    model: Model
+    steps: SearchSteps
+    future: "concurrent.futures.Future[SearchResult]"
+
+
+@dataclasses.dataclass
+class _ActiveSearch:
+    """A search in the engine and the nodes it waits to have scored."""
+
+    model: Model
+    steps: SearchSteps
+    future: "concurrent.futures.Future[SearchResult]"
+    to_score: List[SearchNode]
+
+
+class SubstitutionEngine:
+    """Run concurrent substitution searches in one worker.
+
+    On each tick, the nodes of all active searches are scored together,
+    then each search gets its nodes back and continues to its next step.
+    New searches join at the next tick.
+    """
+
+    def __init__(
+        self,
+        search: SearchFunc = dijkstra.search_with_cache,
+        score: ScoreFunc = expansion.score_nodes,
+    ) -> None:
+        self._search = search
+        self._score = score
+        self._queue: "queue.Queue[_PendingSearch]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def replace(
+        self,
+        model: Model,
+        rvg: ReplacementVariantsGenerator,
+        config: SubstitutionConfig,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> SearchResult:
+        """Find best replacement with the search of the engine.
+
+        Block until the search finishes.
+        The signature matches SubstituteFunc.
+        If the cancel token is cancelled, raise Cancelled.
+        """
+        # the worker is started lazily so that it runs in the process
+        # that handles the requests, not in a parent that forks workers
+        self._ensure_worker()
+        future: "concurrent.futures.Future[SearchResult]" = concurrent.futures.Future()
+        steps = self._search(model, rvg, config, cancel_token)
+        self._queue.put(_PendingSearch(model, steps, future))
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        """Start the worker thread if it is not running."""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        """Advance the searches forever."""
+        active: List[_ActiveSearch] = []
+        while True:
+            # wait for new searches only if there is nothing else to do
+            for pending in self._take_pending(block=not active):
+                search = _start(pending)
+                if search is not None:
+                    active.append(search)
+            active = self._tick(active)
+
+    def _take_pending(self, block: bool) -> List[_PendingSearch]:
+        """Take the searches waiting to join."""
+        taken = [self._queue.get()] if block else []
+        while True:
+            try:
+                taken.append(self._queue.get_nowait())
+            except queue.Empty:
+                return taken
+
+    def _tick(self, active: List[_ActiveSearch]) -> List[_ActiveSearch]:
+        """Score the nodes of all searches and advance them.
+
+        Return the searches that have not finished.
+        """
+        # only searches for the same model can share a call
+        groups: Dict[int, List[_ActiveSearch]] = {}
+        for search in active:
+            groups.setdefault(id(search.model), []).append(search)
+        still_active: List[_ActiveSearch] = []
+        for group in groups.values():
+            still_active.extend(self._tick_group(group))
+        return still_active
+
+    def _tick_group(self, group: List[_ActiveSearch]) -> List[_ActiveSearch]:
+        """Score the nodes of the searches for the same model at once.
+
+        Nodes of different searches share a forward pass
+        only if their caches have similar lengths, see nlp._split_into_batches.
+        If scoring fails, the searches are retried one by one,
+        so that only the search that fails gets the error.
+        """
+        to_score = [node for search in group for node in search.to_score]
+        try:
+            scored = self._score(group[0].model, to_score)
+        except Exception as e:
+            if len(group) > 1:
+                return [
+                    still_active
+                    for search in group
+                    for still_active in self._tick_group([search])
+                ]
+            group[0].steps.close()
+            group[0].future.set_exception(e)
+            return []
+        still_active: List[_ActiveSearch] = []
+        start = 0
+        for search in group:
+            end = start + len(search.to_score)
+            if _advance(search, scored[start:end]):
+                still_active.append(search)
+            start = end
+        return still_active
+
+
+def _start(pending: _PendingSearch) -> Optional[_ActiveSearch]:
+    """Run the search to its first step.
+
+    Return None if it finished right away.
+    """
+    search = _ActiveSearch(pending.model, pending.steps, pending.future, [])
+    if _advance(search, None):
+        return search
+    return None
+
+
+def _advance(search: _ActiveSearch, scored: Optional[List[SearchNode]]) -> bool:
+    """Pass the scored nodes to the search and run it to its next step.
+
+    Return whether the search continues, otherwise its future is done.
+    """
+    try:
+        if scored is None:
+            search.to_score = next(search.steps)
+        else:
+            search.to_score = search.steps.send(scored)
+    except StopIteration as e:
+        search.future.set_result(e.value)
+        return False
+    except Exception as e:
+        search.future.set_exception(e)
+        return False
+    return True
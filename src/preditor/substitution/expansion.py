@@ -0,0 +1,124 @@
+"""This module extends and scores the search nodes.
+
+The nodes are scored from the caches of their parents,
+their texts are tokenized incrementally.
+"""
+
+from typing import Generator, List, Optional, Sequence
+
+from preditor import caching, nlp
+from preditor.config import Config
+from preditor.model.model import Model
+from preditor.substitution import tokenization
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchNode, SearchResult, SearchSteps
+from preditor.substitution.variants import ReplacementVariantsGenerator
+
+
+def create_cache_manager(
+    model: Model, config: SubstitutionConfig
+) -> caching.CacheManager:
+    """Create the manager of the caches of one search."""
+    return caching.CacheManager(
+        model.device,
+        Config.substitution_cache_mb * 2**20,
+        Config.substitution_offload_mb * 2**20,
+        quantized=config.quantize_cache,
+    )
+
+
+def create_start_node(model: Model) -> SearchNode:
+    """Create the node of the empty text."""
+    start_ids, stable_len = tokenization.encode_start(model)
+    return SearchNode("", 0, 0, None, start_ids, stable_len)
+
+
+def relax_nodes(
+    model: Model,
+    nodes: List[SearchNode],
+    rvg: ReplacementVariantsGenerator,
+    min_variants,
+    cache_manager: Optional[caching.CacheManager] = None,
+) -> Generator[List[SearchNode], List[SearchNode], List[SearchNode]]:
+    """Relax nodes by scoring their extensions. Use the cache.
+
+    It is a step of a search: yield the extensions, receive them scored.
+    If a cache manager is given, it takes over the new caches.
+    """
+    to_score = _create_nodes_to_score(model, nodes, rvg, min_variants)
+    scored = yield to_score
+    if cache_manager is not None:
+        cache_manager.add(zip(
+            [node.cache for node in scored], [node.cache for node in to_score]
+        ))
+    return scored
+
+
+def score_nodes(model: Model, to_score: List[SearchNode]) -> List[SearchNode]:
+    """Score the nodes from the caches of their parents."""
+    nlp_diffs, caches = nlp.infer_nlp_of_ids_with_cache(
+        model,
+        [node.input_ids for node in to_score],
+        [node.cache for node in to_score],
+    )
+    return [
+        node._replace(nlp=node.nlp + nlp_diff, cache=cache)
+        for node, nlp_diff, cache in zip(to_score, nlp_diffs, caches)
+    ]
+
+
+def run_steps(model: Model, steps: SearchSteps) -> SearchResult:
+    """Run the steps of a search, score the nodes it asks for."""
+    try:
+        to_score = next(steps)
+        while True:
+            to_score = steps.send(score_nodes(model, to_score))
+    except StopIteration as e:
+        return e.value
+
+
+def _create_nodes_to_score(
+    model: Model,
+    nodes: List[SearchNode],
+    rvg: ReplacementVariantsGenerator,
+    min_variants,
+) -> List[SearchNode]:
+    """Create nodes to score by extending the given nodes. Track the input ids."""
+    to_score: List[SearchNode] = []
+    for node in nodes:
+        extensions, extension_end = rvg.get_extensions(
+            node.num_forms, min_variants
+        )
+        to_score.extend(extend_node(model, node, extensions, extension_end))
+    return to_score
+
+
+def extend_node(
+    model: Model,
+    node: SearchNode,
+    extensions: Sequence[str],
+    extension_end: int,
+) -> List[SearchNode]:
+    """Create nodes to score by extending the node. Track the input ids.
+
+    The new nodes keep the cache and the nlp of their parent.
+    If the tokens of the parent changed at the seam, its cache does not fit,
+    the new node is scored from the beginning.
+    """
+    assert node.input_ids is not None
+    encoded = tokenization.encode_extensions(
+        model, node.input_ids, node.stable_len, node.text, extensions
+    )
+    # the parent's cache and nlp fit only if the tokens they cover are kept
+    cache_len = caching.cache_len(node.cache)
+    extended: List[SearchNode] = []
+    for extension, (input_ids, stable_len) in zip(extensions, encoded):
+        if tokenization.shared_len(node.input_ids, input_ids) > cache_len:
+            new_nlp, cache = node.nlp, node.cache
+        else:
+            new_nlp, cache = 0.0, None
+        extended.append(SearchNode(
+            node.text + extension, new_nlp, extension_end, cache,
+            input_ids, stable_len
+        ))
+    return extended
@@ -1,26 +1,97 @@
 """This module implements nodes in the implicit graph of sentence variants."""
 
-import dataclasses
-from typing import Callable, Optional
+import heapq
+import itertools
+from typing import Callable, Generator, Iterable, List, NamedTuple, Optional, Tuple
+
+import torch
 
 from preditor import caching
 
 
-@dataclasses.dataclass(frozen=True)
-class SearchNode:
-    """A node in the implicit graph of sentence variants."""
+class SearchNode(NamedTuple):
+    """A node in the implicit graph of sentence variants.
+
+    It is a named tuple, the search creates many of them.
+    The input ids encode the text, if they are tracked.
+    The first stable_len of them do not change when the text is extended.
+    """
 
     text: str
     nlp: float
     num_forms: int
     cache: Optional[caching.LazyCache] = None
+    input_ids: Optional[torch.Tensor] = None
+    stable_len: int = 0
 
     @property
     def cache_len(self) -> int:
-        return caching.cache_len(self.cache)
+        return caching.available_len(self.cache)
+
+
+class SearchResult(NamedTuple):
+    """The text found by a search.
 
+    It is not exact if the search was cut short
+    and the text was completed without searching.
+    """
 
+    text: str
+    exact: bool = True
+
+
+# a search as a state machine: it yields the nodes to score,
+# receives them scored, and returns the result
+SearchSteps = Generator[List[SearchNode], List[SearchNode], SearchResult]
 ScoreKey = Callable[[SearchNode], float]
+# the score, the insertion order to break ties, and the node
+_HeapEntry = Tuple[float, int, SearchNode]
+
+
+class OpenSet:
+    """The open nodes of the search.
+
+    The unfinished nodes are kept in a heap ordered by the score,
+    so that the best of them are found without scanning all the nodes.
+    The finished nodes are never relaxed, only the best one of them is kept.
+    """
+
+    def __init__(self, score_key: ScoreKey, num_forms: int) -> None:
+        self._score_key = score_key
+        self._num_forms = num_forms
+        self._heap: List[_HeapEntry] = []
+        self._best_finished: Optional[_HeapEntry] = None
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap) + (self._best_finished is not None)
+
+    def update(self, nodes: Iterable[SearchNode]) -> None:
+        """Add the nodes to the set."""
+        for node in nodes:
+            entry = (self._score_key(node), next(self._counter), node)
+            if node.num_forms < self._num_forms:
+                heapq.heappush(self._heap, entry)
+            elif self._best_finished is None or entry[0] < self._best_finished[0]:
+                self._best_finished = entry
+
+    def best(self) -> SearchNode:
+        """Return the best node, finished or not."""
+        finished = self._best_finished
+        if finished is not None and (not self._heap or finished[0] <= self._heap[0][0]):
+            return finished[2]
+        return self._heap[0][2]
+
+    def best_finished(self) -> Optional[SearchNode]:
+        """Return the best finished node, if there is any."""
+        if self._best_finished is None:
+            return None
+        return self._best_finished[2]
+
+    def pop_unfinished(self, count: int) -> List[SearchNode]:
+        """Remove and return at most count best unfinished nodes, best first."""
+        count = min(count, len(self._heap))
+        return [heapq.heappop(self._heap)[2] for _ in range(count)]
 
 
 def nlp_key(node: SearchNode) -> float:
@@ -7,9 +7,12 @@ from preditor import tags
 from preditor.model.model import Model
 from preditor.substitution import dijkstra
 from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchResult
 from preditor.substitution.variants import ReplacementVariantsGenerator
 
-SubstituteFunc = Callable[[Model, ReplacementVariantsGenerator, SubstitutionConfig], str]
+SubstituteFunc = Callable[
+    [Model, ReplacementVariantsGenerator, SubstitutionConfig], SearchResult
+]
 
 
 def replace(
@@ -17,8 +20,11 @@ def replace(
     before_old: str, old: str, after_old: str, replacement: str,
     config: SubstitutionConfig,
     func: SubstituteFunc = dijkstra.replace_with_cache,
-) -> str:
-    """Replace part of the sentence and modify the rest to match."""
+) -> SearchResult:
+    """Replace part of the sentence and modify the rest to match.
+
+    The result is not exact if the search did not finish in time.
+    """
     previous_sentences, _, next_sentences = _find_sentence_with_old(
         before_old, old, after_old
     )
@@ -31,7 +37,9 @@ def replace(
         config,
         func,
     )
-    return previous_sentences + replaced_sentence + next_sentences
+    return replaced_sentence._replace(
+        text=previous_sentences + replaced_sentence.text + next_sentences
+    )
 
 
 def _find_sentence_with_old(
@@ -60,7 +68,7 @@ def _replace_one_sentence(
     before_old: str, old: str, after_old: str, replacement: str,
     config: SubstitutionConfig,
     func: SubstituteFunc = dijkstra.replace_with_cache,
-) -> str:
+) -> SearchResult:
     """Replace part of the sentence and modify the rest to match."""
     rvg = ReplacementVariantsGenerator(before_old, old, after_old, replacement)
     return func(model, rvg, config)
@@ -0,0 +1,131 @@
+"""This module tokenizes the texts of the search nodes incrementally.
+
+The search extends the texts at their end. The tokens before the last word
+do not change, only the last word and the extension are tokenized again.
+Not all tokenizers allow that, for the others, the whole text is tokenized.
+"""
+
+import functools
+import re
+from typing import List, Sequence, Tuple
+
+import torch
+
+from preditor import nlp
+from preditor.model.model import Model
+
+# the last word with the whitespace before it
+_LAST_WORD = re.compile(r"\s*\S*$")
+# texts checked to be tokenized the same incrementally
+_PROBE_TEXTS = [
+    "Po tiskové konferenci by se měli ještě sejít.",
+    "Zákon, který tohle nerozpozná,  je špatný!",
+    "Ahoj Pepo... Mám pro tebe 12 překvapení (a dort).",
+]
+
+
+def encode_start(model: Model) -> Tuple[torch.Tensor, int]:
+    """Encode the empty text.
+
+    Return the input ids beginning with EOS and the number of stable ids.
+    """
+    input_ids = nlp.encode_with_eos(model, "")[0]
+    return input_ids, len(input_ids)
+
+
+def encode_extensions(
+    model: Model,
+    input_ids: torch.Tensor,
+    stable_len: int,
+    text: str,
+    extensions: Sequence[str],
+) -> List[Tuple[torch.Tensor, int]]:
+    """Encode the text extended by each of the extensions.
+
+    The input ids encode the text, the first stable_len of them
+    cover the text before its last word and are reused.
+    Return the input ids of the extended texts and the numbers of stable ids.
+    """
+    if not _supports_seams(model):
+        return [
+            (nlp.encode_with_eos(model, text + extension)[0], 0)
+            for extension in extensions
+        ]
+    return _encode_seams(model, input_ids, stable_len, text, extensions)
+
+
+def shared_len(input_ids: torch.Tensor, other_ids: torch.Tensor) -> int:
+    """Return the length of the common beginning of the input ids."""
+    length = min(len(input_ids), len(other_ids))
+    mismatches = (input_ids[:length] != other_ids[:length]).nonzero()
+    if len(mismatches) > 0:
+        return int(mismatches[0].item())
+    return length
+
+
+def _encode_seams(
+    model: Model,
+    input_ids: torch.Tensor,
+    stable_len: int,
+    text: str,
+    extensions: Sequence[str],
+) -> List[Tuple[torch.Tensor, int]]:
+    """Encode the extended texts, tokenize only the last word and the extensions.
+
+    The part before the new last word and the new last word
+    are tokenized separately, all of them in one call.
+    """
+    head_end = _last_word_start(text)
+    fragments: List[str] = []
+    for extension in extensions:
+        new_text = text + extension
+        new_head_end = _last_word_start(new_text)
+        fragments.append(new_text[head_end:new_head_end])
+        fragments.append(new_text[new_head_end:])
+    fragment_ids = _encode_fragments(model, fragments)
+    stable_ids = input_ids[:stable_len]
+    return [
+        (torch.cat([stable_ids, middle, tail]), stable_len + len(middle))
+        for middle, tail in zip(fragment_ids[::2], fragment_ids[1::2])
+    ]
+
+
+def _last_word_start(text: str) -> int:
+    """Return the start of the last word, including the whitespace before it."""
+    match = _LAST_WORD.search(text)
+    assert match is not None  # the pattern matches any text
+    return match.start()
+
+
+def _encode_fragments(model: Model, fragments: List[str]) -> List[torch.Tensor]:
+    """Encode parts of a text without special tokens."""
+    ids_batch = model.tokenizer(fragments, add_special_tokens=False)["input_ids"]
+    return [
+        torch.tensor(ids, dtype=torch.long, device=model.device)
+        for ids in ids_batch
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _supports_seams(model: Model) -> bool:
+    """Check that the tokenizer encodes the probe texts the same incrementally.
+
+    The texts are extended by single words and punctuation,
+    which is the hardest case for the seams.
+    """
+    for text in _PROBE_TEXTS:
+        input_ids, stable_len = encode_start(model)
+        current = ""
+        for piece in _split_pieces(text):
+            [(input_ids, stable_len)] = _encode_seams(
+                model, input_ids, stable_len, current, [piece]
+            )
+            current += piece
+        if not torch.equal(input_ids, nlp.encode_with_eos(model, text)[0]):
+            return False
+    return True
+
+
+def _split_pieces(text: str) -> List[str]:
+    """Split the text into whitespace, words and punctuation."""
+    return re.findall(r"\s+|\w+|[^\w\s]", text)
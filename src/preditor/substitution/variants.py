@@ -1,12 +1,16 @@
 """This module generates sentence variants."""
 
-from typing import Set, Tuple
+import itertools
+from typing import Dict, Iterator, Set, Tuple
 
 from preditor import tags
 
 
 class ReplacementVariantsGenerator:
-    """Generate variants of a text with a replaced word."""
+    """Generate variants of a text with a replaced word.
+
+    The extensions are memoized, the search asks for the same ones repeatedly.
+    """
 
     def __init__(
         self, before_old: str, old: str, after_old: str,
@@ -15,10 +19,12 @@ class ReplacementVariantsGenerator:
         text = before_old + old + after_old
         self._tagged_forms = tags.tag(text)
         self._force_replacement(len(before_old), old, replacement)
+        # sorted, so that the extensions are generated in a stable order
         self._variants = [
-            tags.generate_word_variations(form)
+            tuple(sorted(tags.generate_word_variations(form)))
             for form in self._tagged_forms
         ]
+        self._extensions: Dict[Tuple[int, int], Tuple[Tuple[str, ...], int]] = {}
 
     def _force_replacement(
         self, start: int, old_word: str, replacement: str
@@ -47,7 +53,7 @@ class ReplacementVariantsGenerator:
 
     def get_extensions(
         self, extension_begin: int, min_variants: int = 2
-    ) -> Tuple[Set[str], int]:
+    ) -> Tuple[Tuple[str, ...], int]:
         """Construct possible extensions of a prefix of the text.
 
         extension_begin:
@@ -56,19 +62,37 @@ class ReplacementVariantsGenerator:
             The minimum number of variants to construct.
             There will be fewer if the end of the text is reached.
 
-        Return a tuple containing a set of possible extensions
+        Return a tuple containing the possible extensions
         and the index of the end of the extension (exclusive).
+        The extensions are ordered as in iter_extensions.
         """
         min_variants = max(min_variants, 2)  # at least 2 variants needed
-        extension_end = self._find_extension_end(extension_begin, min_variants)
-        extensions = {""}
-        for variants in self._variants[extension_begin:extension_end]:
-            extensions = {
-                extension + variant
-                for variant in variants
-                for extension in extensions
-            }
-        return (extensions, extension_end)
+        key = (extension_begin, min_variants)
+        if key not in self._extensions:
+            extension_end = self._find_extension_end(extension_begin, min_variants)
+            extensions = tuple(self.iter_extensions(extension_begin, extension_end))
+            self._extensions[key] = (extensions, extension_end)
+        return self._extensions[key]
+
+    def iter_extensions(
+        self, extension_begin: int, extension_end: int
+    ) -> Iterator[str]:
+        """Generate the extensions made of the forms from begin to end (exclusive).
+
+        The forms are expanded depth-first, like the paths of a trie,
+        so the extensions sharing their leading forms follow each other.
+        Each extension is generated once.
+        """
+        seen: Set[str] = set()
+        for forms in itertools.product(*self._variants[extension_begin:extension_end]):
+            extension = "".join(forms)
+            if extension not in seen:
+                seen.add(extension)
+                yield extension
+
+    def get_rest(self, extension_begin: int) -> str:
+        """Return the rest of the text from the given form, unchanged."""
+        return "".join(form.form for form in self._tagged_forms[extension_begin:])
 
     def _find_extension_end(
         self, extension_begin: int, min_variants: int
@@ -0,0 +1,273 @@
+"""This module implements diverse beam search on top of the forward pass.
+
+The beams are split into groups.
+At each step, a group is penalized for the tokens
+that the previous groups chose at the same step, so that the groups differ.
+The search follows the group beam search of transformers,
+but only does the work that infilling needs:
+the prompt is processed once and its cache is shared by all beams,
+one forward pass scores all beams,
+and the suppressed tokens are applied as precomputed masks.
+"""
+
+import dataclasses
+from typing import Callable, List, Optional, Tuple
+
+import torch
+
+from preditor import caching
+from preditor.cancellation import CancelToken
+from preditor.model.model import Model
+from preditor.sessions import PrefixCache
+from preditor.suggestion import vocabulary
+
+# the score of the beams that are not active yet
+_INACTIVE_SCORE = -1e9
+
+# tells whether the generated token ids complete a hypothesis
+FinishedFunc = Callable[[List[int]], bool]
+
+
+@dataclasses.dataclass
+class _Hypotheses:
+    """The best finished hypotheses of one group of beams."""
+
+    size: int
+    # stop as soon as there are enough hypotheses
+    early_stopping: bool = False
+    # the score and the generated token ids of each hypothesis
+    items: List[Tuple[float, List[int]]] = dataclasses.field(default_factory=list)
+    done: bool = False
+
+    def add(self, sum_log_probs: float, token_ids: List[int], generated_len: int) -> None:
+        """Add a hypothesis if it is among the best ones.
+
+        The score is the log probability normalized by the length.
+        """
+        score = sum_log_probs / generated_len
+        if len(self.items) < self.size or score > self._worst_score():
+            self.items.append((score, token_ids))
+            if len(self.items) > self.size:
+                del self.items[self._worst_index()]
+
+    def is_done(self, best_sum_log_probs: float, generated_len: int) -> bool:
+        """Return whether no running beam can beat the finished hypotheses.
+
+        The bound assumes the beams end now, as transformers does by default.
+        """
+        if len(self.items) < self.size:
+            return False
+        if self.early_stopping:
+            return True
+        return self._worst_score() >= best_sum_log_probs / generated_len
+
+    def _worst_score(self) -> float:
+        return self.items[self._worst_index()][0]
+
+    def _worst_index(self) -> int:
+        return min(range(len(self.items)), key=lambda i: self.items[i][0])
+
+
+def diverse_beam_search(
+    model: Model,
+    input_ids: torch.Tensor,
+    begin_suppress_mask: Optional[torch.Tensor],
+    suppress_mask: Optional[torch.Tensor],
+    max_length: int,
+    num_groups: int,
+    group_size: int,
+    diversity_penalty: float,
+    prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
+    is_finished: Optional[FinishedFunc] = None,
+) -> List[List[int]]:
+    """Generate continuations of the prompt with diverse beam search.
+
+    The tokens in the begin suppress mask are suppressed at the first step only,
+    the tokens in the suppress mask at every step.
+    A beam ends with EOS, or once is_finished returns true for its tokens.
+    With is_finished, a group stops as soon as it has enough hypotheses,
+    the beams still running have not reached what the caller waits for.
+    Return the token ids of all finished hypotheses, from the best one.
+    If a prefix cache is given, reuse the attention cache of the previous prompt.
+    If the cancel token is cancelled, stop and raise Cancelled.
+    """
+    num_beams = num_groups * group_size
+    eos_token_ids = _get_eos_token_ids(model)
+    pad_token_id = model.tokenizer.eos_token_id
+    cache = None
+    cache_len = 0
+    if prefix_cache is not None:
+        cache, cache_len = prefix_cache.lookup(input_ids)
+    logits, cache = _forward(model, input_ids[cache_len:].unsqueeze(0), cache)
+    if prefix_cache is not None:
+        prefix_cache.update(input_ids, cache)
+    vocab_size = logits.shape[-1]
+    begin_mask = _fit_mask(begin_suppress_mask, vocab_size, logits.device)
+    mask = _fit_mask(suppress_mask, vocab_size, logits.device)
+
+    # all beams continue the same prompt, only the first beam of each group is active
+    logits = logits.expand(num_beams, -1)
+    cache = caching.expand_cache(cache, num_beams)
+    beam_scores = torch.full((num_beams,), _INACTIVE_SCORE, device=logits.device)
+    beam_scores[::group_size] = 0
+    sequences: List[List[int]] = [[] for _ in range(num_beams)]
+    groups = [
+        _Hypotheses(group_size, early_stopping=is_finished is not None)
+        for _ in range(num_groups)
+    ]
+    # each beam has at most one candidate of each EOS token among the best ones,
+    # the extra candidates replace those that finish with is_finished
+    num_candidates = max(2, 1 + len(eos_token_ids)) * group_size
+    if is_finished is not None:
+        num_candidates += group_size
+
+    for step in range(max_length):
+        log_probs = torch.log_softmax(logits, dim=-1)
+        if step == 0:
+            log_probs = log_probs.masked_fill(begin_mask, -float("inf"))
+        log_probs = log_probs.masked_fill(mask, -float("inf"))
+        # how many times the previous groups chose each token at this step
+        token_counts = torch.zeros(vocab_size, device=logits.device)
+        next_tokens: List[int] = []
+        next_scores: List[float] = []
+        next_beams: List[int] = []
+        for group_index, group in enumerate(groups):
+            start = group_index * group_size
+            if group.done:
+                # the beams of a finished group only pad
+                group_tokens = [pad_token_id] * group_size
+                group_scores = [0.0] * group_size
+                group_beams = [start] * group_size
+            else:
+                group_log_probs = log_probs[start:start + group_size]
+                scores = (
+                    (group_log_probs - diversity_penalty * token_counts)
+                    + beam_scores[start:start + group_size].unsqueeze(1)
+                )
+                values, indices = scores.view(-1).topk(num_candidates)
+                group_tokens, group_scores, group_beams = _choose_beams(
+                    group, sequences, start, values.tolist(), indices.tolist(),
+                    vocab_size, eos_token_ids, step + 1, is_finished
+                )
+                group.done = group.is_done(values[0].item(), step + 1)
+            token_counts.index_put_(
+                (torch.tensor(group_tokens, device=logits.device),),
+                torch.ones(group_size, device=logits.device),
+                accumulate=True,
+            )
+            next_tokens.extend(group_tokens)
+            next_scores.extend(group_scores)
+            next_beams.extend(group_beams)
+
+        sequences = [sequences[beam] + [token] for beam, token in zip(next_beams, next_tokens)]
+        beam_scores = torch.tensor(next_scores, device=logits.device)
+        if cancel_token is not None:
+            cancel_token.check()
+        if all(group.done for group in groups) or step == max_length - 1:
+            break
+        beam_indices = torch.tensor(next_beams, device=logits.device)
+        tokens = torch.tensor(next_tokens, device=logits.device).unsqueeze(1)
+        logits, cache = _forward(model, tokens, caching.select_cache(cache, beam_indices))
+
+    return _finalize(groups, sequences, beam_scores.tolist(), group_size)
+
+
+def _choose_beams(
+    group: _Hypotheses,
+    sequences: List[List[int]],
+    start: int,
+    scores: List[float],
+    indices: List[int],
+    vocab_size: int,
+    eos_token_ids: List[int],
+    generated_len: int,
+    is_finished: Optional[FinishedFunc] = None,
+) -> Tuple[List[int], List[float], List[int]]:
+    """Choose the continuations of the beams of a group from the best candidates.
+
+    A candidate ending with EOS finishes a hypothesis if it ranks high enough.
+    So does a candidate for which is_finished returns true, its token is kept.
+    A lower ranking one continues like any other candidate.
+    Return the tokens, scores and source beams of the continued beams.
+    """
+    tokens: List[int] = []
+    beam_scores: List[float] = []
+    beams: List[int] = []
+    for rank, (score, index) in enumerate(zip(scores, indices)):
+        beam = start + index // vocab_size
+        token = index % vocab_size
+        if token in eos_token_ids:
+            if rank < group.size:
+                group.add(score, sequences[beam], generated_len)
+        elif (
+            rank < group.size
+            and is_finished is not None
+            and is_finished(sequences[beam] + [token])
+        ):
+            group.add(score, sequences[beam] + [token], generated_len)
+        else:
+            tokens.append(token)
+            beam_scores.append(score)
+            beams.append(beam)
+            if len(tokens) == group.size:
+                break
+    return tokens, beam_scores, beams
+
+
+def _finalize(
+    groups: List[_Hypotheses],
+    sequences: List[List[int]],
+    beam_scores: List[float],
+    group_size: int,
+) -> List[List[int]]:
+    """Finish the running beams and return all hypotheses, from the best one."""
+    for group_index, group in enumerate(groups):
+        if group.done:
+            continue
+        for beam in range(group_index * group_size, (group_index + 1) * group_size):
+            group.add(beam_scores[beam], sequences[beam], len(sequences[beam]))
+    hypotheses = sorted(
+        (item for group in groups for item in group.items), key=lambda item: item[0]
+    )
+    return [token_ids for _, token_ids in reversed(hypotheses)]
+
+
+def _forward(
+    model: Model, input_ids: torch.Tensor, cache: Optional[caching.Cache]
+) -> Tuple[torch.Tensor, caching.Cache]:
+    """Run the model on the new tokens after the cache.
+
+    Return the logits of the last position and the cache.
+    The LM head is only applied to the last position.
+    """
+    lm_head = model.model.get_output_embeddings()
+    with torch.no_grad():
+        if lm_head is None:
+            outputs = model.model(
+                input_ids=input_ids, past_key_values=cache, use_cache=True, return_dict=True
+            )
+            return outputs.logits[:, -1].float(), outputs.past_key_values
+        outputs = model.model.base_model(
+            input_ids=input_ids, past_key_values=cache, use_cache=True, return_dict=True
+        )
+        return lm_head(outputs.last_hidden_state[:, -1]).float(), outputs.past_key_values
+
+
+def _fit_mask(
+    mask: Optional[torch.Tensor], vocab_size: int, device: torch.device
+) -> torch.Tensor:
+    """Fit the mask of the vocabulary to the logits, no mask suppresses nothing."""
+    if mask is None:
+        return torch.zeros(vocab_size, dtype=torch.bool, device=device)
+    return vocabulary.fit_mask(mask, vocab_size).to(device)
+
+
+def _get_eos_token_ids(model: Model) -> List[int]:
+    """Return the tokens that end a hypothesis, as generate would."""
+    eos_token_id = model.model.generation_config.eos_token_id
+    if eos_token_id is None:
+        return [model.tokenizer.eos_token_id]
+    if isinstance(eos_token_id, int):
+        return [eos_token_id]
+    return list(eos_token_id)
@@ -1,69 +1,134 @@
 """This module provides generic utils for generation."""
 
-import functools
-from typing import Iterable, List
+from typing import Iterable, List, Optional, Pattern, Tuple
 
 import torch
-from transformers import LogitsProcessorList, PreTrainedTokenizer, SuppressTokensAtBeginLogitsProcessor, SuppressTokensLogitsProcessor
+from transformers import LogitsProcessor, LogitsProcessorList, PreTrainedTokenizer
 
+from preditor.cancellation import CancelToken
 from preditor.model.model import Model
-from preditor.suggestion import generation
+from preditor.sessions import PrefixCache
+from preditor.suggestion import decoding, generation, vocabulary
+
+# each variant of beam search is kept by this many beams
+BEAMS_PER_VARIANT = 2
+# how much a group of beams is penalized for each token chosen by the previous groups
+DIVERSITY_PENALTY = 20.0
 
 
 def beam_search(
     model: Model,
     input_text: str,
     should_start_with_space: bool,
-    suppress_tokens: List[int],
+    suppress_mask: Optional[torch.Tensor],
     max_length: int,
-    num_variants: int
+    num_variants: int,
+    prefix_cache: Optional[PrefixCache] = None,
+    cancel_token: Optional[CancelToken] = None,
+    stop_pattern: Optional[Pattern[str]] = None,
 ) -> List[str]:
-    """Generate continuations using beam search."""
-    input_ids = generation.encode_with_eos(model, input_text).to(model.device)
-    input_len = len(input_ids[0])
-    processors = get_suppress_processors(
-        model.tokenizer, should_start_with_space, input_len, suppress_tokens
-    )
+    """Generate continuations using diverse beam search.
 
-    gen_ids = model.model.generate(
-        input_ids,
-        logits_processor=processors,
-        max_new_tokens=max_length,
-        num_return_sequences=num_variants * 2,
-        num_beams=num_variants * 2,
-        num_beam_groups=num_variants,
-        diversity_penalty=20.0,
-        pad_token_id=model.tokenizer.eos_token_id
+    Each variant is the result of one group of beams.
+    The tokens in the suppress mask are never generated.
+    If a stop pattern is given, a beam ends once its decoded text matches it.
+    If a prefix cache is given, reuse the attention cache of the previous prompt.
+    If the cancel token is cancelled, stop and raise Cancelled.
+    """
+    input_ids = generation.encode_with_eos(model, input_text).to(model.device)
+    begin_suppress_mask = None
+    if should_start_with_space:
+        begin_suppress_mask = get_mask_without_prefix_space(model.tokenizer)
+    infills_ids = decoding.diverse_beam_search(
+        model, input_ids[0], begin_suppress_mask, suppress_mask,
+        max_length, num_variants, BEAMS_PER_VARIANT, DIVERSITY_PENALTY,
+        prefix_cache, cancel_token, _create_finished_func(model, stop_pattern),
     )
-    infills_ids = gen_ids[:, input_len:]
     decoded_infills = model.tokenizer.batch_decode(infills_ids, skip_special_tokens=True)
     return decoded_infills
 
 
+def _create_finished_func(
+    model: Model, stop_pattern: Optional[Pattern[str]]
+) -> Optional[decoding.FinishedFunc]:
+    """Create a function telling whether the decoded tokens match the pattern."""
+    if stop_pattern is None:
+        return None
+
+    def is_finished(token_ids: List[int]) -> bool:
+        decoded = model.tokenizer.decode(token_ids, skip_special_tokens=True)
+        return stop_pattern.search(decoded) is not None
+
+    return is_finished
+
+
 def get_suppress_processors(
     tokenizer: PreTrainedTokenizer, should_start_with_space: bool, input_len: int,
-    suppress_tokens: Iterable[int]
+    suppress_mask: Optional[torch.Tensor] = None,
 ) -> LogitsProcessorList:
     """Get the processors for suppressing tokens in the generation."""
     processors = LogitsProcessorList()
     if should_start_with_space:
-        nospace_tokens = _get_tokens_without_prefix_space(tokenizer)
-        nospace_processor = SuppressTokensAtBeginLogitsProcessor(nospace_tokens, input_len)
-        processors.append(nospace_processor)
-    if suppress_tokens:
-        suppress_processor = SuppressTokensLogitsProcessor(suppress_tokens)
-        processors.append(suppress_processor)
+        nospace_mask = get_mask_without_prefix_space(tokenizer)
+        processors.append(SuppressMaskLogitsProcessor(nospace_mask, begin_index=input_len))
+    if suppress_mask is not None:
+        processors.append(SuppressMaskLogitsProcessor(suppress_mask))
     return processors
 
 
-@functools.lru_cache(maxsize=None)
-def _get_tokens_without_prefix_space(tokenizer: PreTrainedTokenizer) -> List[int]:
-    """Get the token ids that are not preceded by a space in the tokenizer."""
-    token_ids = tokenizer.get_vocab().values()
-    return [
-        token_id for token_id in token_ids
-        if not tokenizer.decode([token_id])[0].isspace()
-    ]
+def get_batch_suppress_processors(
+    tokenizer: PreTrainedTokenizer, should_start_with_space: List[bool], input_len: int
+) -> LogitsProcessorList:
+    """Get the processors for suppressing tokens in a batched generation.
+
+    Each item in the batch can require a different start of the output.
+    """
+    processors = LogitsProcessorList()
+    rows = [i for i, with_space in enumerate(should_start_with_space) if with_space]
+    if rows:
+        nospace_mask = get_mask_without_prefix_space(tokenizer)
+        processors.append(
+            SuppressMaskLogitsProcessor(nospace_mask, begin_index=input_len, rows=rows)
+        )
+    return processors
+
+
+class SuppressMaskLogitsProcessor(LogitsProcessor):
+    """Suppress the tokens in a mask of the vocabulary.
+
+    If a begin index is given, only at the beginning of the generation.
+    If rows are given, only in those rows of the batch.
+    """
+
+    def __init__(
+        self,
+        mask: torch.Tensor,
+        begin_index: Optional[int] = None,
+        rows: Optional[Iterable[int]] = None,
+    ) -> None:
+        self.mask = mask
+        self.begin_index = begin_index
+        self.rows = None if rows is None else torch.tensor(list(rows))
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.begin_index is not None and input_ids.shape[1] != self.begin_index:
+            return scores
+        mask = vocabulary.fit_mask(self.mask, scores.shape[-1]).to(scores.device)
+        if self.rows is None:
+            return scores.masked_fill(mask, -float("inf"))
+        rows = self.rows.to(scores.device)
+        scores[rows] = scores[rows].masked_fill(mask, -float("inf"))
+        return scores
+
+
+def get_mask_without_prefix_space(tokenizer: PreTrainedTokenizer) -> torch.Tensor:
+    """Get the mask of the tokens that are not preceded by a space in the tokenizer."""
+    return vocabulary.get_mask(tokenizer, "without_prefix_space", _starts_without_space)
+
+
+def _starts_without_space(text: str) -> bool:
+    """Return whether the text of a token does not start with a space."""
+    return not text[:1].isspace()
 
 
 def trim_decoded(decoded: str, had_trailing_space: bool) -> str:
@@ -95,3 +160,19 @@ def encode_with_eos(model: Model, text: str) -> torch.Tensor:
     if text == "":
         return eos_tensor
     return torch.cat([eos_tensor, input_ids], dim=-1).to(model.device)
+
+
+def left_pad(input_ids: List[torch.Tensor], pad_token_id: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Pad the input ids from the left to the same length.
+
+    Return the padded ids and the attention mask.
+    The mask hides only the padding, not the tokens equal to the pad token.
+    The pad token is EOS, which also begins every input, see encode_with_eos.
+    """
+    max_len = max(len(ids) for ids in input_ids)
+    padded = torch.full((len(input_ids), max_len), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+    for i, ids in enumerate(input_ids):
+        padded[i, max_len - len(ids):] = ids
+        attention_mask[i, max_len - len(ids):] = 1
+    return padded, attention_mask
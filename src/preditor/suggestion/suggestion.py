@@ -5,9 +5,9 @@ Suggestion combines prediction and infilling tasks.
 
 from typing import List
 
-from preditor.infilling import infilling
+from preditor.infilling import end, infilling, selection
 from preditor.model.model import Model
-from preditor.prediction import prediction
+from preditor.prediction import confidence, prediction
 
 
 def suggest(
@@ -15,6 +15,9 @@ def suggest(
     before_cursor: str, after_cursor: str,
     prediction_config: prediction.PredictionConfig,
     infilling_config: infilling.InfillingConfig,
+    predict_func: prediction.PredictFunc = confidence.generate,
+    generate_func: infilling.GenerateFunc = end.generate_infills,
+    select_func: infilling.SelectFunc = selection.select_by_score,
 ) -> str:
     """Get a suggestion for the given position in the text.
 
@@ -27,10 +30,13 @@ def suggest(
     joined_after = " ".join(lines_after)
     if joined_after:
         return infilling.infill(
-            model, joined_before, joined_after, infilling_config
+            model, joined_before, joined_after, infilling_config,
+            generate_func, select_func
         )
     else:
-        return prediction.predict(model, joined_before, prediction_config)
+        return prediction.predict(
+            model, joined_before, prediction_config, predict_func
+        )
 
 
 def _get_first_paragraph(lines: List[str]) -> List[str]:
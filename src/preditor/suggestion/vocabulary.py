@@ -0,0 +1,110 @@
+"""This module computes masks of the tokens in a vocabulary.
+
+Finding the tokens to suppress needs the text of every token,
+which takes seconds for a large vocabulary if they are decoded one by one.
+Fast tokenizers decode the whole vocabulary in one batch instead.
+The masks are also stored in files keyed by a hash of the tokenizer
+and of the source of the predicate,
+so that each process of the server loads them instead of computing them.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from typing import Callable, Optional, Tuple
+
+import torch
+from transformers import PreTrainedTokenizer
+
+from preditor.config import Config
+
+
+@functools.lru_cache(maxsize=None)
+def get_mask(
+    tokenizer: PreTrainedTokenizer, name: str, predicate: Callable[[str], bool]
+) -> torch.Tensor:
+    """Return the mask of the tokens whose text satisfies the predicate.
+
+    The text of a token is what tokenizer.decode returns for it alone.
+    The name identifies the predicate in the cache file.
+    """
+    path = _get_cache_path(tokenizer, name, predicate)
+    if path is not None and os.path.exists(path):
+        return torch.load(path)
+    token_ids, texts = _decode_vocabulary(tokenizer)
+    mask = torch.zeros(max(token_ids, default=-1) + 1, dtype=torch.bool)
+    mask[list(token_ids)] = torch.tensor([predicate(text) for text in texts], dtype=torch.bool)
+    if path is not None:
+        _save(mask, path)
+    return mask
+
+
+def fit_mask(mask: torch.Tensor, vocab_size: int) -> torch.Tensor:
+    """Pad or trim the mask to the size of the model's vocabulary.
+
+    The model may have more logits than the tokenizer has tokens.
+    """
+    if len(mask) >= vocab_size:
+        return mask[:vocab_size]
+    return torch.cat([mask, mask.new_zeros(vocab_size - len(mask))])
+
+
+@functools.lru_cache(maxsize=None)
+def _decode_vocabulary(tokenizer: PreTrainedTokenizer) -> Tuple[Tuple[int, ...], Tuple[str, ...]]:
+    """Decode each token of the vocabulary on its own.
+
+    Return the token ids and their texts.
+    """
+    token_ids = tuple(sorted(tokenizer.get_vocab().values()))
+    if not tokenizer.is_fast:
+        return token_ids, tuple(tokenizer.decode([token_id]) for token_id in token_ids)
+    texts = tokenizer.backend_tokenizer.decode_batch(
+        [[token_id] for token_id in token_ids], skip_special_tokens=False
+    )
+    # decode cleans up the texts after the backend decodes them
+    if tokenizer.clean_up_tokenization_spaces:
+        texts = [tokenizer.clean_up_tokenization(text) for text in texts]
+    return token_ids, tuple(texts)
+
+
+def _get_cache_path(
+    tokenizer: PreTrainedTokenizer, name: str, predicate: Callable[[str], bool]
+) -> Optional[str]:
+    """Return the path of the cache file of the mask, or None if caching is off.
+
+    A changed predicate gets a new file, the old one is not loaded.
+    """
+    if not Config.vocabulary_cache_dir:
+        return None
+    filename = f"{_hash_tokenizer(tokenizer)}-{name}-{_hash_predicate(predicate)}.pt"
+    return os.path.join(Config.vocabulary_cache_dir, filename)
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_tokenizer(tokenizer: PreTrainedTokenizer) -> str:
+    """Hash everything that decides the texts of the tokens."""
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode())
+    digest.update(str(tokenizer.clean_up_tokenization_spaces).encode())
+    if tokenizer.is_fast:
+        digest.update(tokenizer.backend_tokenizer.to_str().encode())
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    return digest.hexdigest()
+
+
+def _hash_predicate(predicate: Callable[[str], bool]) -> str:
+    """Hash the source of the predicate."""
+    return hashlib.sha256(inspect.getsource(predicate).encode()).hexdigest()[:16]
+
+
+def _save(mask: torch.Tensor, path: str) -> None:
+    """Save the mask so that other processes never read a partial file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as file:
+        torch.save(mask, file)
+    os.replace(file.name, path)
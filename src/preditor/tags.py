@@ -4,15 +4,20 @@ It can analyze sentences and generate word forms.
 """
 
 import dataclasses
+import functools
 from typing import Iterator, List, Optional, Set, Tuple
 
 from ufal import morphodita
 
+from preditor import paradigms
 from preditor.config import Config
 
 tagger = morphodita.Tagger.load(Config.tagger_path)
 if not tagger:
     raise Exception(f"Cannot load tagger from file '{Config.tagger_path}'.")
+paradigm_index: Optional[paradigms.ParadigmIndex] = None
+if Config.paradigm_index_path:
+    paradigm_index = paradigms.ParadigmIndex.load(Config.paradigm_index_path)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -96,16 +101,30 @@ def generate_word_variations(original: TaggedForm) -> Set[str]:
     original_result = {original.form}
     if original.lemma is None or original.tag is None:
         return original_result
+    forms = generate_forms(original.lemma, create_tag_wildcard(original.tag))
+    variations = {copy_case(form, original.form) for form in forms}
+    return variations | original_result
+
+
+@functools.lru_cache(maxsize=Config.paradigm_cache_size)
+def generate_forms(lemma: str, wildcard: str) -> Tuple[str, ...]:
+    """Generate the forms of the lemma matching the tag wildcard.
+
+    The same lemmas recur often, so the forms are memoized.
+    The paradigm index is used first, if there is one.
+    """
+    if paradigm_index is not None:
+        forms = paradigm_index.get(lemma, wildcard)
+        if forms is not None:
+            return forms
     morpho = tagger.getMorpho()
-    wildcard = create_tag_wildcard(original.tag)
     lemmas_forms = morphodita.TaggedLemmasForms()  # type: ignore[abstract]
-    morpho.generate(original.lemma, wildcard, GUESSER, lemmas_forms)
-    variations = {
-        copy_case(form.form, original.form)
+    morpho.generate(lemma, wildcard, GUESSER, lemmas_forms)
+    return tuple(
+        form.form
         for lemma_forms in lemmas_forms
         for form in lemma_forms.forms
-    }
-    return variations | original_result
+    )
 
 
 def copy_case(word: str, reference: str) -> str:
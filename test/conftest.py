@@ -0,0 +1,68 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import (
+    GenerationConfig, LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+)
+
+from preditor.model.model import Model
+
+TEXTS = [
+    "Petr šel rychle do obchodu a koupil si nové auto.",
+    "Po tiskové konferenci by se měli ještě vrátit k diskusi.",
+    "Ten velký pes běžel přes zelenou louku.",
+    "Vyplň mezeru označenou ___ nebo tečkami...",
+]
+
+
+class TinyModel(Model):
+    """A small random Llama with a tokenizer trained on a few sentences."""
+
+    def __init__(self, tokenizer: PreTrainedTokenizerFast) -> None:
+        torch.manual_seed(0)
+        self._tokenizer = tokenizer
+        config = LlamaConfig(
+            vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64,
+            num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+            eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.eos_token_id,
+        )
+        self._model = LlamaForCausalLM(config).eval()
+        self._config = GenerationConfig(pad_token_id=tokenizer.eos_token_id)
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer
+
+    @property
+    def prefix_space_tokenizer(self):
+        return self._tokenizer
+
+    @property
+    def device(self):
+        return self._model.device
+
+    @property
+    def config(self):
+        return self._config
+
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer():
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=400, special_tokens=["</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tokenizer.train_from_iterator(TEXTS, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="</s>")
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tiny_tokenizer):
+    return TinyModel(tiny_tokenizer)
@@ -0,0 +1,18 @@
+import pytest
+
+from preditor.infilling import end
+
+
+@pytest.mark.parametrize("after, generated, expected", [
+    ("do obchodu.", " rychle do", True),
+    ("do obchodu.", " rychle do obchodu", True),
+    ("do obchodu.", " do", False),
+    ("do obchodu.", " rychle domů", False),
+    ("do obchodu.", " rychle\nA", True),
+    ("do obchodu.", "\n rychle", False),
+    (", a pak", " rychle,", True),
+    ("", " rychle", False),
+])
+def test_stop_pattern_matches_start_of_after_cursor(after, generated, expected):
+    pattern = end._get_stop_pattern(after)
+    assert (pattern.search(generated) is not None) == expected
@@ -0,0 +1,42 @@
+import pytest
+
+from preditor import nlp
+from preditor.infilling import selection
+from preditor.infilling.config import InfillingConfig
+
+BEFORE = "Petr šel"
+VARIANTS = [" rychle pěšky domů"]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def infer_nlp_after_shared_prefix(model, texts, prefix_cache=None):
+        calls.append(texts)
+        # the shorter texts are better
+        return [float(len(text)) for text in texts]
+
+    monkeypatch.setattr(nlp, "infer_nlp_after_shared_prefix", infer_nlp_after_shared_prefix)
+    return calls
+
+
+def test_only_best_pruned_infills_are_fully_scored(calls):
+    after = " do obchodu, kde si koupil nové auto, a pak jel domů."
+    config = InfillingConfig(max_scored_infills=2)
+
+    infill = selection.select_by_score(VARIANTS, None, BEFORE, after, config)
+
+    pruning, scoring = calls
+    # the candidates are ranked with the first word after cursor
+    assert len(pruning) == 4
+    assert all(text.endswith(" do") for text in pruning)
+    assert set(scoring) == {BEFORE + " rychle" + after, BEFORE + " rychle " + after}
+    assert infill == " rychle"
+
+
+def test_short_text_after_cursor_is_not_pruned(calls):
+    config = InfillingConfig(max_scored_infills=2)
+    selection.select_by_score(VARIANTS, None, BEFORE, " do obchodu.", config)
+    [scoring] = calls
+    assert len(scoring) == 4
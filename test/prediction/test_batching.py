@@ -0,0 +1,39 @@
+import threading
+
+import pytest
+
+from preditor.prediction import batching
+from preditor.prediction.config import PredictionConfig
+
+
+def test_scheduler_fans_out_results():
+    batch_sizes = []
+
+    def func(model, texts, configs, prefix_caches, cancel_tokens):
+        batch_sizes.append(len(texts))
+        return [text.upper() for text in texts]
+
+    scheduler = batching.PredictionScheduler(4, 50.0, func)
+    texts = [f"text {i}" for i in range(10)]
+    results = {}
+
+    def predict(text):
+        results[text] = scheduler.generate(None, text, PredictionConfig())
+
+    threads = [threading.Thread(target=predict, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {text: text.upper() for text in texts}
+    assert sum(batch_sizes) == len(texts)
+    assert max(batch_sizes) <= 4
+
+
+def test_scheduler_propagates_errors():
+    def func(model, texts, configs, prefix_caches, cancel_tokens):
+        raise ValueError("failed")
+
+    scheduler = batching.PredictionScheduler(4, 1.0, func)
+    with pytest.raises(ValueError):
+        scheduler.generate(None, "text", PredictionConfig())
@@ -0,0 +1,33 @@
+import torch
+
+from preditor.prediction import confidence
+from preditor.prediction.config import PredictionConfig
+
+
+def run_criteria(criteria, token_probs):
+    """Feed the criteria with steps where the chosen token has the given probability."""
+    scores = []
+    is_done = None
+    for step, prob in enumerate(token_probs, start=1):
+        logits = torch.log(torch.tensor([[prob, 1 - prob]]))
+        scores.append(logits)
+        input_ids = torch.zeros(1, step, dtype=torch.long)
+        is_done = criteria(input_ids, tuple(scores))
+        if is_done[0]:
+            return step
+    return len(token_probs)
+
+
+def test_stops_when_longer_prefix_cannot_win():
+    config = PredictionConfig(max_length=10, confidence=1.0)
+    criteria = confidence.UsefulnessStoppingCriteria([config])
+    steps = run_criteria(criteria, [0.999, 0.001, 0.999, 0.999])
+    assert steps == 2
+
+
+def test_continues_while_confident():
+    config = PredictionConfig(max_length=5, confidence=1.0)
+    criteria = confidence.UsefulnessStoppingCriteria([config])
+    steps = run_criteria(criteria, [0.999] * 8)
+    assert steps == 5
+    assert criteria.num_steps == [5]
@@ -0,0 +1,68 @@
+from preditor.substitution import beam, expansion
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchNode
+
+WEIGHTS = {"a": 1.0, "b": 2.0, "c": 4.0}
+
+
+class StubRVG:
+    """Three forms, each with the variants a, b and c."""
+
+    num_forms = 3
+
+    def get_extensions(self, begin, min_variants):
+        return tuple(WEIGHTS), begin + 1
+
+
+class StubCacheManager:
+    """Record the released caches."""
+
+    def __init__(self):
+        self.released = []
+
+    def use(self, caches):
+        list(caches)
+
+    def add(self, caches):
+        list(caches)
+
+    def release(self, caches):
+        self.released.extend(cache for cache in caches if cache is not None)
+
+
+def extend_node(model, node, extensions, extension_end):
+    return [
+        SearchNode(node.text + extension, node.nlp, extension_end, node.cache)
+        for extension in extensions
+    ]
+
+
+def score(node):
+    """Add the weight of the last variant, the cache is the text."""
+    return node._replace(nlp=node.nlp + WEIGHTS[node.text[-1]], cache=node.text)
+
+
+def test_beam_keeps_best_nodes_and_releases_dropped_caches(monkeypatch):
+    cache_manager = StubCacheManager()
+    monkeypatch.setattr(expansion, "create_cache_manager", lambda model, config: cache_manager)
+    monkeypatch.setattr(expansion, "create_start_node", lambda model: SearchNode("", 0.0, 0))
+    monkeypatch.setattr(expansion, "extend_node", extend_node)
+    config = SubstitutionConfig(beam_width=2)
+
+    steps = beam.search(None, StubRVG(), config)
+    to_score = next(steps)
+    all_scored = []
+    try:
+        while True:
+            scored = [score(node) for node in to_score]
+            all_scored.append(scored)
+            to_score = steps.send(scored)
+            # only the nodes in the beam are extended
+            assert len({node.text[:-1] for node in to_score}) == config.beam_width
+    except StopIteration as e:
+        result = e.value
+
+    assert result.text == "aaa"
+    last_beam = sorted(all_scored[-1], key=config.score_key)[:config.beam_width]
+    all_caches = {node.cache for scored in all_scored for node in scored}
+    assert set(cache_manager.released) == all_caches - {node.cache for node in last_beam}
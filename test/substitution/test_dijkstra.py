@@ -0,0 +1,67 @@
+import itertools
+
+from preditor.substitution import dijkstra, expansion
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchNode, SearchResult
+
+WEIGHTS = {"a": 1.0, "b": 2.0, "c": 4.0}
+
+
+class StubRVG:
+    """Three forms, each with the variants a, b and c."""
+
+    num_forms = 3
+
+    def get_extensions(self, begin, min_variants):
+        return tuple(WEIGHTS), begin + 1
+
+    def get_rest(self, begin):
+        return f" rest{begin}"
+
+
+class StubCacheManager:
+    def use(self, caches):
+        list(caches)
+
+    def add(self, caches):
+        list(caches)
+
+    def release(self, caches):
+        list(caches)
+
+
+def extend_node(model, node, extensions, extension_end):
+    return [
+        SearchNode(node.text + extension, node.nlp, extension_end)
+        for extension in extensions
+    ]
+
+
+def score(node):
+    """Add the weight of the last variant, the rest adds nothing."""
+    return node._replace(nlp=node.nlp + WEIGHTS.get(node.text[-1], 0.0))
+
+
+def test_search_past_deadline_completes_best_open_node(monkeypatch):
+    monkeypatch.setattr(
+        expansion, "create_cache_manager", lambda model, config: StubCacheManager()
+    )
+    monkeypatch.setattr(expansion, "create_start_node", lambda model: SearchNode("", 0.0, 0))
+    monkeypatch.setattr(expansion, "extend_node", extend_node)
+    # the deadline is set at 0 and passes after the first step
+    clock = itertools.chain([0.0, 0.0], itertools.repeat(1.0))
+    monkeypatch.setattr(dijkstra.time, "monotonic", lambda: next(clock))
+    config = SubstitutionConfig(deadline_ms=500)
+
+    steps = dijkstra.search_with_cache(None, StubRVG(), config)
+    to_score = next(steps)
+    all_to_score = []
+    try:
+        while True:
+            all_to_score.append([node.text for node in to_score])
+            to_score = steps.send([score(node) for node in to_score])
+    except StopIteration as e:
+        result = e.value
+
+    assert all_to_score == [["a", "b", "c"], ["a rest1", "b rest1", "c rest1"]]
+    assert result == SearchResult("a rest1", exact=False)
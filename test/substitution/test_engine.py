@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from preditor.substitution import engine
+from preditor.substitution.config import SubstitutionConfig
+from preditor.substitution.search import SearchNode, SearchResult
+
+
+def count_search(model, rvg, config, cancel_token=None):
+    """Score the text rvg times, one node at a time."""
+    node = SearchNode(rvg, 0.0, 0)
+    for _ in range(rvg):
+        [node] = yield [node]
+    return SearchResult(f"{node.text}:{node.nlp}")
+
+
+def run_together(substitution_engine, monkeypatch, counts):
+    """Queue all searches before the worker starts, return their results or errors."""
+    ensure_worker = substitution_engine._ensure_worker
+    monkeypatch.setattr(substitution_engine, "_ensure_worker", lambda: None)
+    results = {}
+
+    def replace(count):
+        try:
+            results[count] = substitution_engine.replace(None, count, SubstitutionConfig())
+        except Exception as e:
+            results[count] = e
+
+    threads = [threading.Thread(target=replace, args=(count,)) for count in counts]
+    for thread in threads:
+        thread.start()
+    while substitution_engine._queue.qsize() < len(counts):
+        time.sleep(0.001)
+    ensure_worker()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_engine_interleaves_searches(monkeypatch):
+    call_sizes = []
+
+    def score(model, to_score):
+        call_sizes.append(len(to_score))
+        return [node._replace(nlp=node.nlp + 1) for node in to_score]
+
+    substitution_engine = engine.SubstitutionEngine(count_search, score)
+    counts = [1, 2, 3, 4, 5, 6]
+    results = run_together(substitution_engine, monkeypatch, counts)
+    assert results == {count: SearchResult(f"{count}:{count}.0") for count in counts}
+    # each tick scores the nodes of all searches that have not finished
+    assert call_sizes == [6, 5, 4, 3, 2, 1]
+
+
+def test_engine_fails_only_search_whose_scoring_fails(monkeypatch):
+    def score(model, to_score):
+        if any(node.text == 2 for node in to_score):
+            raise ValueError("failed")
+        return [node._replace(nlp=node.nlp + 1) for node in to_score]
+
+    substitution_engine = engine.SubstitutionEngine(count_search, score)
+    results = run_together(substitution_engine, monkeypatch, [1, 2, 3])
+    assert isinstance(results[2], ValueError)
+    assert results[1] == SearchResult("1:1.0")
+    assert results[3] == SearchResult("3:3.0")
+
+
+def test_engine_propagates_errors():
+    def score(model, to_score):
+        raise ValueError("failed")
+
+    substitution_engine = engine.SubstitutionEngine(count_search, score)
+    with pytest.raises(ValueError):
+        substitution_engine.replace(None, 2, SubstitutionConfig())
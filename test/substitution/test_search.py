@@ -0,0 +1,29 @@
+from preditor.substitution.search import OpenSet, SearchNode, nlp_key
+
+
+def test_open_set_pops_best_unfinished_nodes():
+    open_nodes = OpenSet(nlp_key, num_forms=3)
+    open_nodes.update([
+        SearchNode("a", 3.0, 1), SearchNode("b", 1.0, 2),
+        SearchNode("c", 2.0, 3), SearchNode("d", 4.0, 1),
+    ])
+    assert open_nodes.best().text == "b"
+    assert [node.text for node in open_nodes.pop_unfinished(2)] == ["b", "a"]
+    assert open_nodes.best().text == "c"
+    assert len(open_nodes) == 2
+
+
+def test_open_set_keeps_only_best_finished_node():
+    open_nodes = OpenSet(nlp_key, num_forms=1)
+    open_nodes.update([SearchNode("a", 2.0, 1), SearchNode("b", 1.0, 1)])
+    assert open_nodes.best().text == "b"
+    assert open_nodes.pop_unfinished(5) == []
+
+
+def test_open_set_returns_best_finished_node():
+    open_nodes = OpenSet(nlp_key, num_forms=2)
+    assert open_nodes.best_finished() is None
+    open_nodes.update([SearchNode("a", 1.0, 1), SearchNode("b", 3.0, 2)])
+    open_nodes.update([SearchNode("c", 2.0, 2)])
+    assert open_nodes.best_finished().text == "c"
+    assert open_nodes.best().text == "a"
@@ -0,0 +1,26 @@
+import pytest
+import torch
+
+from preditor.substitution import tokenization
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", 0),
+    ("Po", 0),
+    ("Po tiskové", 2),
+    ("Po tiskové,", 2),
+    ("Zákon,  který", 6),
+])
+def test_last_word_start(text, expected):
+    assert tokenization._last_word_start(text) == expected
+
+
+@pytest.mark.parametrize("input_ids, other_ids, expected", [
+    ([0, 1, 2], [0, 1, 2], 3),
+    ([0, 1, 2], [0, 1, 3, 4], 2),
+    ([0, 1], [0, 1, 2], 2),
+    ([0, 1], [1, 1], 0),
+])
+def test_shared_len(input_ids, other_ids, expected):
+    shared = tokenization.shared_len(torch.tensor(input_ids), torch.tensor(other_ids))
+    assert shared == expected
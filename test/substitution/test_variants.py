@@ -0,0 +1,30 @@
+from preditor import tags
+from preditor.substitution import variants
+
+FORMS = ["Ten", " ", "a", "b"]
+VARIATIONS = {"a": {"ab", "a"}, "b": {"bb", "b"}}
+
+
+def create_rvg(monkeypatch):
+    monkeypatch.setattr(
+        tags, "tag", lambda text: [tags.TaggedForm(None, None, form) for form in FORMS]
+    )
+    monkeypatch.setattr(
+        tags, "generate_word_variations",
+        lambda form: VARIATIONS.get(form.form, {form.form}),
+    )
+    return variants.ReplacementVariantsGenerator("", "Ten", " ab", "Ta")
+
+
+def test_extensions_are_memoized(monkeypatch):
+    rvg = create_rvg(monkeypatch)
+    extensions = rvg.get_extensions(2, 4)
+    assert rvg.get_extensions(2, 4) is extensions
+    assert rvg.get_extensions(2, 1) is rvg.get_extensions(2, 2)
+
+
+def test_extensions_are_unique_and_sorted(monkeypatch):
+    rvg = create_rvg(monkeypatch)
+    # "a" + "bb" and "ab" + "b" are the same extension
+    assert rvg.get_extensions(2, 4) == (("ab", "abb", "abbb"), 4)
+    assert list(rvg.iter_extensions(0, 3)) == ["Ta a", "Ta ab"]
@@ -0,0 +1,31 @@
+import pytest
+
+from preditor.suggestion import decoding
+
+
+def test_hypotheses_keep_best_by_normalized_score():
+    hypotheses = decoding._Hypotheses(size=2)
+    hypotheses.add(-4.0, [1, 2], 2)
+    hypotheses.add(-3.0, [3], 1)
+    hypotheses.add(-3.0, [4, 5, 6], 3)
+    assert [token_ids for _, token_ids in hypotheses.items] == [[1, 2], [4, 5, 6]]
+
+
+@pytest.mark.parametrize("best_sum_log_probs, generated_len, expected", [
+    (-6.0, 2, True),
+    (-3.0, 2, False),
+    (-6.0, 4, False),
+])
+def test_hypotheses_are_done_when_no_beam_can_beat_them(
+    best_sum_log_probs, generated_len, expected
+):
+    hypotheses = decoding._Hypotheses(size=1)
+    hypotheses.add(-2.0, [1], 1)
+    assert hypotheses.is_done(best_sum_log_probs, generated_len) == expected
+
+
+def test_hypotheses_with_early_stopping_are_done_when_full():
+    hypotheses = decoding._Hypotheses(size=1, early_stopping=True)
+    assert not hypotheses.is_done(-1.0, 1)
+    hypotheses.add(-2.0, [1], 1)
+    assert hypotheses.is_done(-1.0, 1)
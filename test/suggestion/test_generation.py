@@ -0,0 +1,12 @@
+import torch
+
+from preditor.suggestion import generation
+
+
+def test_left_pad_masks_only_padding():
+    eos = 2
+    input_ids = [torch.tensor([eos, 5, 6]), torch.tensor([eos])]
+    padded, attention_mask = generation.left_pad(input_ids, eos)
+    assert padded.tolist() == [[eos, 5, 6], [eos, eos, eos]]
+    # the leading EOS of each input is attended to
+    assert attention_mask.tolist() == [[1, 1, 1], [0, 0, 1]]
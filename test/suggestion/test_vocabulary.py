@@ -0,0 +1,51 @@
+import os
+
+import pytest
+import torch
+
+from preditor.config import Config
+from preditor.infilling import blank
+from preditor.suggestion import generation, vocabulary
+
+
+@pytest.mark.parametrize("mask, vocab_size, expected", [
+    ([True, False], 4, [True, False, False, False]),
+    ([True, False, True], 2, [True, False]),
+    ([False, True], 2, [False, True]),
+])
+def test_fit_mask(mask, vocab_size, expected):
+    fitted = vocabulary.fit_mask(torch.tensor(mask), vocab_size)
+    assert fitted.tolist() == expected
+
+
+@pytest.mark.parametrize("name, predicate", [
+    ("without_prefix_space", generation._starts_without_space),
+    ("blank", blank._resembles_blank),
+])
+def test_mask_equals_decoding_tokens_one_by_one(tiny_tokenizer, name, predicate):
+    mask = vocabulary.get_mask(tiny_tokenizer, name, predicate)
+    expected = [
+        token_id for token_id in tiny_tokenizer.get_vocab().values()
+        if predicate(tiny_tokenizer.decode([token_id]))
+    ]
+    assert mask.nonzero().flatten().tolist() == sorted(expected)
+    assert 0 < len(expected) < len(tiny_tokenizer)
+
+
+def test_mask_is_stored_and_loaded(tiny_tokenizer, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "vocabulary_cache_dir", str(tmp_path))
+    vocabulary.get_mask.cache_clear()
+    mask = vocabulary.get_mask(tiny_tokenizer, "blank", blank._resembles_blank)
+    [filename] = os.listdir(tmp_path)
+
+    def fail(tokenizer):
+        raise AssertionError("the mask should be loaded")
+
+    monkeypatch.setattr(vocabulary, "_decode_vocabulary", fail)
+    vocabulary.get_mask.cache_clear()
+    assert torch.equal(vocabulary.get_mask(tiny_tokenizer, "blank", blank._resembles_blank), mask)
+    # a changed predicate does not load the mask of the old one
+    assert vocabulary._get_cache_path(
+        tiny_tokenizer, "blank", generation._starts_without_space
+    ) != os.path.join(tmp_path, filename)
+    vocabulary.get_mask.cache_clear()
@@ -0,0 +1,69 @@
+import torch
+
+from preditor import caching
+
+
+def _lazy_cache(length: int) -> caching.LazyCache:
+    # one layer with one head, 8 bytes per position, with padding
+    keys = torch.arange(length + 2, dtype=torch.float32).reshape(1, 1, -1, 1)
+    cache = ((keys, -keys),)
+    return caching.LazyCache(cache, length)
+
+
+def test_least_recently_used_cache_is_dropped():
+    manager = caching.CacheManager(torch.device("cpu"), max_bytes=16, block_size=1)
+    first, second, third = _lazy_cache(1), _lazy_cache(1), _lazy_cache(1)
+    manager.add([(first, None), (second, None)])
+    manager.use([first])
+    manager.add([(third, None)])
+    assert caching.available_len(second) == 0
+    assert caching.cache_len(second) == 1
+    assert caching.available_len(first) == 1
+    assert caching.available_len(third) == 1
+    assert manager.resident_bytes == 16
+
+
+def test_cache_shares_full_blocks_of_parent():
+    manager = caching.CacheManager(torch.device("cpu"), max_bytes=1024, block_size=2)
+    parent, child = _lazy_cache(3), _lazy_cache(5)
+    manager.add([(parent, None)])
+    expected = caching.trim_cache(child.cache, 0, 5)
+    manager.add([(child, parent)])
+    assert parent.blocks is not None and child.blocks is not None
+    assert child.blocks.table[:1] == parent.blocks.table[:1]
+    # a block of two positions takes 16 bytes, one of them is shared
+    assert manager.resident_bytes == 4 * 16
+    [(keys, values)] = caching.join_caches([child])
+    assert torch.equal(keys, expected[0][0]) and torch.equal(values, expected[0][1])
+    manager.release([parent])
+    assert manager.resident_bytes == 3 * 16
+
+
+def test_cache_is_offloaded_before_dropped():
+    manager = caching.CacheManager(
+        torch.device("cuda"), max_bytes=8, max_offload_bytes=8, block_size=1
+    )
+    first, second, third = _lazy_cache(1), _lazy_cache(1), _lazy_cache(1)
+    manager.add([(first, None)])
+    manager.add([(second, None)])
+    assert first.cache is not None and first.blocks is None
+    manager.add([(third, None)])
+    assert caching.available_len(first) == 0
+    assert second.cache is not None
+    manager.release([third])
+    manager.use([second])
+    assert second.blocks is not None
+    assert manager.resident_bytes == 8
+
+
+def test_quantized_pool_approximates_cache():
+    manager = caching.CacheManager(
+        torch.device("cpu"), max_bytes=1024, block_size=2, quantized=True
+    )
+    lazy_cache = _lazy_cache(3)
+    expected = caching.trim_cache(lazy_cache.cache, 0, 3)
+    manager.add([(lazy_cache, None)])
+    [(keys, values)] = caching.join_caches([lazy_cache])
+    assert keys.dtype == torch.float32
+    assert torch.allclose(keys, expected[0][0], atol=0.01)
+    assert torch.allclose(values, expected[0][1], atol=0.01)
@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from preditor import cancellation
+
+
+def test_new_request_supersedes_running_one():
+    in_flight = cancellation.InFlightRequests()
+    with in_flight.track("session") as first:
+        with in_flight.track("session") as second:
+            assert first.cancelled
+            assert not second.cancelled
+            with in_flight.track("other") as other:
+                assert not second.cancelled
+                assert not other.cancelled
+    with pytest.raises(cancellation.Cancelled):
+        first.check()
+    second.check()
+
+
+def test_stopping_criteria_covers_all_beams():
+    tokens = [cancellation.CancelToken(), None, cancellation.CancelToken()]
+    tokens[2].cancel()
+    criteria = cancellation.get_stopping_criteria(tokens)
+    input_ids = torch.zeros(6, 3, dtype=torch.long)
+    is_done = criteria(input_ids, None)
+    assert is_done.tolist() == [False, False, False, False, True, True]
@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+from preditor import nlp, sessions
+from preditor.config import Config
+
+
+@pytest.mark.parametrize("input_ids_batch, expected", [
+    ([[0, 1, 2, 3], [0, 1, 2, 4]], 3),
+    ([[0, 1, 2], [0, 1, 2, 3]], 3),
+    ([[0, 1], [0, 1]], 2),
+    ([[0, 1], [5, 1]], 0),
+])
+def test_common_prefix_len(input_ids_batch, expected):
+    tensors = [torch.tensor(input_ids) for input_ids in input_ids_batch]
+    assert nlp._common_prefix_len(tensors) == expected
+
+
+@pytest.mark.parametrize("sizes, token_budget, expected", [
+    ([5, 30, 7, 6, 40, 2], 40, [[4], [1], [2, 3, 0, 5]]),
+    ([3, 3, 3], 100, [[0, 1, 2]]),
+    ([50, 10], 20, [[0], [1]]),
+])
+def test_split_into_batches(sizes, token_budget, expected):
+    spans = [(0, size) for size in sizes]
+    assert nlp._split_into_batches(spans, token_budget) == expected
+
+
+@pytest.mark.parametrize("spans, token_budget, expected", [
+    # an item without a cache would make the cached one recompute it
+    ([(40, 45), (40, 45), (0, 44)], 1000, [[0, 1], [2]]),
+    ([(40, 45), (38, 44), (0, 3)], 1000, [[0, 1], [2]]),
+    # the budget counts the width from the shortest cache
+    ([(40, 45), (36, 45), (36, 44)], 20, [[0, 1], [2]]),
+])
+def test_split_into_batches_by_cache(spans, token_budget, expected):
+    assert nlp._split_into_batches(spans, token_budget) == expected
+
+
+def test_padding_counts_width_from_shortest_cache():
+    stats = nlp.padding_stats
+    before = (stats.real_tokens, stats.padded_tokens)
+    nlp._record_padding([(40, 45), (36, 44)])
+    assert (stats.real_tokens - before[0], stats.padded_tokens - before[1]) == (13, 18)
+
+
+@pytest.mark.parametrize("device", ["cpu", "meta"])
+def test_target_mask_is_on_device_of_input_ids(device):
+    input_ids_batch = [torch.tensor([0, 1, 2, 3], device=device), torch.tensor([0, 1], device=device)]
+    mask = nlp._get_target_mask(input_ids_batch, [0, 1], 0, 3)
+    assert mask.device.type == device
+    if device == "cpu":
+        assert mask.tolist() == [[True, True, True], [False, False, False]]
+
+
+def test_lean_and_full_scoring_give_same_nlps(tiny_model, monkeypatch):
+    texts = ["Petr šel rychle do obchodu.", "Ten pes", ""]
+    monkeypatch.setattr(Config, "scoring_mode", "full")
+    full = nlp.infer_nlp(tiny_model, texts)
+    monkeypatch.setattr(Config, "scoring_mode", "lean")
+    assert nlp._is_lean(tiny_model)
+    assert nlp.infer_nlp(tiny_model, texts) == pytest.approx(full, abs=1e-4)
+
+
+def test_scores_with_warm_session_cache_equal_scores_without(tiny_model):
+    infills = [" rychle", " pomalu do", " domů"]
+    after = " a koupil si nové auto."
+    prefix_cache = sessions.PrefixCacheStore(2**20).get("session")
+    for before in ["Petr šel", "Petr šel včera večer"]:
+        texts = [before + infill + after for infill in infills]
+        cached = nlp.infer_nlp_after_shared_prefix(tiny_model, texts, prefix_cache)
+        uncached = nlp.infer_nlp_after_shared_prefix(tiny_model, texts)
+        assert cached == pytest.approx(uncached, abs=1e-4)
@@ -0,0 +1,22 @@
+from preditor import paradigms
+
+
+def test_index_returns_written_forms(tmp_path):
+    path = str(tmp_path / "paradigms.tsv")
+    paradigms.write_index(path, [
+        ("pes", "NN??1-----A----", ["pes", "psi"]),
+        ("být", "VB-??---?P-AAI--", ["je", "jsou", "jsme"]),
+        ("a", "J^-------------", []),
+    ])
+    index = paradigms.ParadigmIndex.load(path)
+    assert len(index) == 3
+    assert index.get("pes", "NN??1-----A----") == ("pes", "psi")
+    assert index.get("být", "VB-??---?P-AAI--") == ("je", "jsou", "jsme")
+    assert index.get("a", "J^-------------") == ()
+    assert index.get("pes", "NN??2-----A----") is None
+
+
+def test_empty_index(tmp_path):
+    path = tmp_path / "paradigms.tsv"
+    path.write_text("")
+    assert paradigms.ParadigmIndex.load(str(path)).get("pes", "") is None
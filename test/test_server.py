@@ -0,0 +1,74 @@
+import importlib
+import json
+import types
+
+import pytest
+
+from preditor import cancellation
+from preditor.infilling import blank
+from preditor.model import hf
+from preditor.suggestion import generation, suggestion
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # the server loads the model when it is imported
+    monkeypatch.setattr(hf, "HFModel", lambda path: types.SimpleNamespace(tokenizer=None))
+    monkeypatch.setattr(generation, "get_mask_without_prefix_space", lambda tokenizer: None)
+    monkeypatch.setattr(blank, "get_blank_mask", lambda tokenizer: None)
+    return importlib.import_module("preditor.server")
+
+
+def stream_events(server, monkeypatch, suggest):
+    monkeypatch.setattr(suggestion, "suggest", suggest)
+    response = server.app.test_client().post(
+        "/suggest/stream/", json={"before_cursor": "Petr šel", "after_cursor": ""}
+    )
+    assert response.mimetype == "text/event-stream"
+    events = []
+    for chunk in response.get_data(as_text=True).split("\n\n"):
+        if chunk:
+            event, data = chunk.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def streaming_suggest(error=None):
+    """Stream two pieces of text to the streamer of the prediction."""
+    def suggest(model, before_cursor, after_cursor, prediction_config, infilling_config,
+                predict_func):
+        streamer = predict_func.keywords["streamer"]
+        streamer.on_finalized_text(" rychle")
+        streamer.on_finalized_text(" domů")
+        if error is not None:
+            raise error
+        return " rychle domů"
+
+    return suggest
+
+
+def test_stream_sends_tokens_then_output(server, monkeypatch):
+    events = stream_events(server, monkeypatch, streaming_suggest())
+    assert events == [
+        ("token", {"text": " rychle"}),
+        ("token", {"text": " domů"}),
+        ("output", {"output": " rychle domů"}),
+    ]
+
+
+def test_stream_sends_error_when_superseded(server, monkeypatch):
+    events = stream_events(server, monkeypatch, streaming_suggest(cancellation.Cancelled()))
+    assert events == [
+        ("token", {"text": " rychle"}),
+        ("token", {"text": " domů"}),
+        ("error", server.SUPERSEDED_BODY),
+    ]
+
+
+def test_stream_sends_error_when_suggestion_fails(server, monkeypatch):
+    events = stream_events(server, monkeypatch, streaming_suggest(ValueError("failed")))
+    assert events == [
+        ("token", {"text": " rychle"}),
+        ("token", {"text": " domů"}),
+        ("error", {"error": "failed"}),
+    ]
@@ -0,0 +1,35 @@
+import torch
+
+from preditor import sessions
+
+
+def make_cache(length):
+    keys = torch.arange(length, dtype=torch.float32).reshape(1, 1, length, 1)
+    return ((keys, keys.clone()),)
+
+
+def test_lookup_reuses_common_prefix():
+    store = sessions.PrefixCacheStore(2**20)
+    prefix_cache = store.get("session")
+    prefix_cache.update(torch.tensor([0, 1, 2, 3]), make_cache(6))
+    cache, length = prefix_cache.lookup(torch.tensor([0, 1, 2, 5, 6]))
+    assert length == 3
+    assert cache[0][0].shape[2] == 3
+    # the last token is never taken from the cache
+    _, length = prefix_cache.lookup(torch.tensor([0, 1, 2, 3]))
+    assert length == 3
+    cache, length = prefix_cache.lookup(torch.tensor([7, 8]))
+    assert cache is None and length == 0
+
+
+def test_least_recently_used_is_evicted():
+    # each stored cache takes 2 * 4 * 4 bytes
+    store = sessions.PrefixCacheStore(64)
+    ids = torch.tensor([0, 1, 2, 3, 4])
+    store.update("a", ids[:4], make_cache(4))
+    store.update("b", ids[:4], make_cache(4))
+    store.lookup("a", ids)
+    store.update("c", ids[:4], make_cache(4))
+    assert store.lookup("a", ids)[1] == 4
+    assert store.lookup("b", ids)[1] == 0
+    assert store.lookup("c", ids)[1] == 4